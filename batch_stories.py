@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+FableForge AI Story Engine - Batch Story Generation
+Generates one story (and optionally its narration) per row of a CSV or JSONL
+manifest, using the same prompt templates as the Story Generator page.
+Finished rows are recorded in the output directory, so an interrupted run
+picks up where it stopped.
+
+Manifest columns (all but `idea`/`theme` are optional):
+    Text stories:  id, idea, length, tone, audience
+    Image stories: id, image (path), theme, length, genre, include_moral
+
+Usage:
+    python batch_stories.py stories.csv --output-dir story_pack --parallel 4 --audio
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+
+from gemini_utility import gemini_pro_response, gemini_pro_vision_response
+from image_utility import prepare_upload
+from prompt_templates import render
+from rate_limiter import PRIORITY_BULK
+from stats_utility import percentile
+from tts_utility import get_tts_client
+
+TEXT_STORY_DEFAULTS = {"length": "Short", "tone": "Cheerful", "audience": "All Ages"}
+IMAGE_STORY_DEFAULTS = {"length": "Short (5-10 lines)", "genre": "Adventure", "include_moral": True}
+
+
+def read_manifest(path):
+    """Yield (line number, row dict) from a CSV or JSONL manifest without loading it all.
+
+    JSONL lines that are not a JSON object are reported and skipped.
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                if not isinstance(row, dict):
+                    print(f"⚠️ Line {line_number}: not a JSON object, skipped")
+                    continue
+                yield line_number, row
+        else:
+            for line_number, row in enumerate(csv.DictReader(f), 2):
+                yield line_number, {key: value for key, value in row.items() if key and value not in (None, "")}
+
+def row_id(row):
+    """The row's `id`, or a hash of its contents so reordering the manifest is safe"""
+    if row.get("id"):
+        return str(row["id"])
+    return hashlib.sha256(json.dumps(row, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
+
+def row_request(row, manifest_dir):
+    """Return (template name, template inputs, image path or None) for a manifest row"""
+    if row.get("image"):
+        inputs = {**IMAGE_STORY_DEFAULTS, **{key: row[key] for key in ("theme", "length", "genre") if key in row}}
+        if "include_moral" in row:
+            inputs["include_moral"] = _as_bool(row["include_moral"])
+        if "theme" not in inputs:
+            raise ValueError("image rows need a 'theme'")
+        return "image_story", inputs, os.path.join(manifest_dir, row["image"])
+    if not row.get("idea"):
+        raise ValueError("text rows need an 'idea'")
+    inputs = {**TEXT_STORY_DEFAULTS, **{key: row[key] for key in ("idea", "length", "tone", "audience") if key in row}}
+    return "text_story", inputs, None
+
+
+class BatchOutputStore:
+    """Stories, audio and a results.jsonl ledger in one directory.
+
+    A row counts as done once its ledger entry is written, which happens
+    after its files, so a crash mid-row only means the row is redone.
+    Failed rows are retried on the next run.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.results_path = os.path.join(directory, "results.jsonl")
+        os.makedirs(directory, exist_ok=True)
+        self.completed = set()
+        if os.path.exists(self.results_path):
+            with open(self.results_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last line from a crash
+                        continue
+                    if record.get("status") == "done":
+                        self.completed.add(record["id"])
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        return name
+
+    def save_story(self, story_id, story):
+        return self._write(f"{story_id}.txt", story.encode("utf-8"))
+
+    def save_audio(self, story_id, audio):
+        return self._write(f"{story_id}.wav", audio)
+
+    def record(self, outcome):
+        with open(self.results_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(outcome, ensure_ascii=False) + "\n")
+        if outcome["status"] == "done":
+            self.completed.add(outcome["id"])
+
+
+def generate_row(story_id, row, args, store, manifest_dir, tts_client=None):
+    """Generate, narrate and save one row; returns its ledger entry"""
+    start = time.perf_counter()
+    outcome = {"id": story_id, "status": "failed", "files": []}
+    try:
+        template, inputs, image_path = row_request(row, manifest_dir)
+        rendered = render(template, inputs)
+        if image_path:
+            with open(image_path, "rb") as f:
+                image = prepare_upload(f.read()).blob
+            result = gemini_pro_vision_response(
+                rendered.prompt, image, use_cache=args.use_cache, task=rendered.task, overrides=args.overrides,
+                priority=PRIORITY_BULK
+            )
+        else:
+            result = gemini_pro_response(
+                rendered.prompt, use_cache=args.use_cache, task=rendered.task, overrides=args.overrides,
+                priority=PRIORITY_BULK
+            )
+        outcome.update(template=template, model=result.model, cached=result.cached, usage=result.usage)
+        if not result.ok:
+            outcome["error"] = result.error
+            return outcome
+        outcome["files"].append(store.save_story(story_id, result.text))
+        if tts_client is not None:
+            audio = tts_client.synthesize(result.text)
+            if audio:
+                outcome["files"].append(store.save_audio(story_id, audio))
+        outcome["status"] = "done"
+    except Exception as e:
+        outcome["error"] = str(e)
+    finally:
+        outcome["latency"] = time.perf_counter() - start
+    return outcome
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a story pack from a CSV/JSONL manifest")
+    parser.add_argument("manifest", help="CSV or JSONL file with one story per row")
+    parser.add_argument("--output-dir", default="story_pack", help="Where stories, audio and results.jsonl go")
+    parser.add_argument("--parallel", type=int, default=4, help="Rows generated at the same time")
+    parser.add_argument("--audio", action="store_true", help="Also narrate each story (needs HUGGINGFACE_API_KEY)")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="Do not reuse cached responses")
+    parser.add_argument("--model", help="Model to use instead of the per-task default")
+    parser.add_argument("--temperature", type=float, help="Temperature (only with --model)")
+    parser.add_argument("--max-tokens", type=int, help="Maximum output tokens per story")
+    args = parser.parse_args(argv)
+    args.overrides = {
+        key: value
+        for key, value in (("model", args.model), ("temperature", args.temperature), ("max_tokens", args.max_tokens))
+        if value is not None
+    }
+    return args
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    tts_client = None
+    if args.audio:
+        api_key = os.getenv("HUGGINGFACE_API_KEY")
+        if not api_key:
+            print("❌ --audio needs HUGGINGFACE_API_KEY")
+            return 1
+        tts_client = get_tts_client(api_key)
+
+    store = BatchOutputStore(args.output_dir)
+    manifest_dir = os.path.dirname(os.path.abspath(args.manifest))
+    latencies = []
+    counts = {"done": 0, "failed": 0, "skipped": 0}
+    pending = set()
+
+    def collect(futures):
+        for future in futures:
+            outcome = future.result()
+            store.record(outcome)
+            counts[outcome["status"]] += 1
+            latencies.append(outcome["latency"])
+            if outcome["status"] == "done":
+                print(f"✅ {outcome['id']} in {outcome['latency']:.1f}s{' (cached)' if outcome.get('cached') else ''}")
+            else:
+                print(f"❌ {outcome['id']} after {outcome['latency']:.1f}s: {outcome.get('error')}")
+
+    print(f"📚 Generating stories from {args.manifest} with {args.parallel} in parallel")
+    start = time.perf_counter()
+    seen = set()
+    with ThreadPoolExecutor(max_workers=args.parallel, thread_name_prefix="batch") as executor:
+        try:
+            for line_number, row in read_manifest(args.manifest):
+                story_id = row_id(row)
+                if story_id in seen:
+                    print(f"⚠️ Line {line_number}: duplicate id {story_id}, skipped")
+                    continue
+                seen.add(story_id)
+                if story_id in store.completed:
+                    counts["skipped"] += 1
+                    continue
+                # Only a bounded number of rows are read ahead of the workers
+                if len(pending) >= args.parallel * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(generate_row, story_id, row, args, store, manifest_dir, tts_client))
+        finally:
+            # Rows already paid for reach results.jsonl even if reading the manifest fails
+            collect(wait(pending).done)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    processed = counts["done"] + counts["failed"]
+    print(f"\n📊 {counts['done']} done, {counts['failed']} failed, {counts['skipped']} already done")
+    if processed:
+        print(
+            f"⏱️ {elapsed:.1f}s total, {processed / elapsed * 60:.1f} rows/min | per row "
+            f"p50 {percentile(latencies, 0.5):.1f}s, p95 {percentile(latencies, 0.95):.1f}s, max {latencies[-1]:.1f}s"
+        )
+    print(f"💾 Outputs in {args.output_dir}")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+FableForge AI Story Engine - Offline Benchmark Suite
+Drives the generation, chat, story and TTS code paths against local stand-ins
+for Gemini, the Hugging Face TTS endpoint and the Gradio video client, so
+latency and throughput can be compared across changes without keys or network.
+
+Usage:
+    python benchmark.py --requests 100 --concurrency 16
+    python benchmark.py --scenarios text,stream --compare .fableforge/benchmarks/<earlier run>.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import functools
+import platform
+import tempfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+# Benchmarks measure this process, not the real API quota or a warm disk cache
+os.environ.setdefault("FABLEFORGE_RATE_LIMIT_RPM", "1000000")
+os.environ.setdefault("FABLEFORGE_RATE_LIMIT_TPM", "1000000000")
+os.environ.setdefault("FABLEFORGE_CACHE_DIR", tempfile.mkdtemp(prefix="fableforge-bench-"))
+
+from PIL import Image
+
+from chat_utility import ChatContextManager, stream_chat_message
+from gemini_utility import (
+    embeddings_model_response,
+    gemini_pro_response,
+    gemini_pro_vision_response,
+    gemini_stream_response,
+    load_model_for_task,
+    summarize_transcript
+)
+from fake_backends import FakeBackend, add_backend_arguments, backend_config_from_args
+from image_utility import prepare_upload
+from instrumentation import metrics
+from model_router import get_model_router
+from stats_utility import format_stat, percentile
+from tts_utility import NarrationPipeline
+
+RESULTS_DIR = os.getenv("FABLEFORGE_BENCHMARK_DIR", os.path.join(".fableforge", "benchmarks"))
+
+
+@dataclass
+class Sample:
+    """One measured request; `first_token` is set for streamed requests"""
+    latency: float
+    ok: bool
+    first_token: float = None
+
+
+def _timed_stream(stream, start, on_text=None):
+    first_token = None
+    for text in stream:
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        if on_text is not None:
+            on_text(text)
+    return first_token
+
+
+def _scenario_text(backend, index):
+    start = time.perf_counter()
+    result = gemini_pro_response(f"Write a short story about dragon #{index}.", use_cache=False, task="text_story")
+    return [Sample(time.perf_counter() - start, result.ok)]
+
+@functools.lru_cache(maxsize=1)
+def _sample_image():
+    buffer = io.BytesIO()
+    Image.new("RGB", (1024, 768), (120, 160, 200)).save(buffer, format="PNG")
+    return prepare_upload(buffer.getvalue()).blob
+
+def _scenario_vision(backend, index):
+    start = time.perf_counter()
+    result = gemini_pro_vision_response(f"Tell story #{index} about this picture.", _sample_image(), use_cache=False)
+    return [Sample(time.perf_counter() - start, result.ok)]
+
+def _scenario_embed(backend, index):
+    start = time.perf_counter()
+    result = embeddings_model_response(f"A tale of a lighthouse keeper, variant {index}.")
+    return [Sample(time.perf_counter() - start, result.ok)]
+
+def _scenario_stream(backend, index):
+    start = time.perf_counter()
+    stream = gemini_stream_response(f"Write a short story about castle #{index}.", task="text_story")
+    first_token = _timed_stream(stream, start)
+    return [Sample(time.perf_counter() - start, stream.ok, first_token)]
+
+def _scenario_story(backend, index):
+    """Streamed story narrated sentence by sentence, as on the Story Generator page"""
+    start = time.perf_counter()
+    narration = NarrationPipeline(backend.tts)
+    stream = gemini_stream_response(f"Write a bedtime story about owl #{index}.", task="text_story")
+
+    def feed(text):
+        narration.feed(text)
+        list(narration.ready_segments())
+
+    first_token = _timed_stream(stream, start, feed)
+    narration.finish()
+    audio_ok = all(error is None for _, error in narration.remaining_segments())
+    return [Sample(time.perf_counter() - start, stream.ok and audio_ok, first_token)]
+
+def _scenario_chat(backend, index, turns=4):
+    """One streamed multi-turn conversation with history compaction between turns"""
+    model, _ = load_model_for_task("chat")
+    chat_session = model.start_chat(history=[])
+    context = ChatContextManager(summarize_transcript)
+    samples = []
+    for turn in range(turns):
+        context.compact(chat_session)
+        start = time.perf_counter()
+        try:
+            first_token = _timed_stream(stream_chat_message(chat_session, f"Tell me more ({index}.{turn})"), start)
+            samples.append(Sample(time.perf_counter() - start, True, first_token))
+        except Exception:
+            samples.append(Sample(time.perf_counter() - start, False))
+            break
+    return samples
+
+def _scenario_tts(backend, index):
+    text = " ".join(f"Sentence {sentence} of narration {index} goes here." for sentence in range(6))
+    start = time.perf_counter()
+    try:
+        backend.tts.synthesize(text)
+        ok = True
+    except Exception:
+        ok = False
+    return [Sample(time.perf_counter() - start, ok)]
+
+SCENARIOS = {
+    "text": _scenario_text,
+    "vision": _scenario_vision,
+    "embed": _scenario_embed,
+    "stream": _scenario_stream,
+    "story": _scenario_story,
+    "chat": _scenario_chat,
+    "tts": _scenario_tts,
+}
+
+
+def run_scenario(name, backend, requests, concurrency):
+    """Run one scenario under concurrency and summarize its samples"""
+    scenario = SCENARIOS[name]
+    tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"bench-{name}") as executor:
+        samples = [sample for batch in executor.map(lambda index: scenario(backend, index), range(requests))
+                   for sample in batch]
+    elapsed = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = sorted(sample.latency for sample in samples if sample.ok)
+    first_tokens = sorted(sample.first_token for sample in samples if sample.ok and sample.first_token is not None)
+    return {
+        "scenario": name,
+        "requests": len(samples),
+        "errors": sum(not sample.ok for sample in samples),
+        "p50_s": percentile(latencies, 0.50),
+        "p95_s": percentile(latencies, 0.95),
+        "p99_s": percentile(latencies, 0.99),
+        "ttft_p50_s": percentile(first_tokens, 0.50),
+        "ttft_p95_s": percentile(first_tokens, 0.95),
+        "throughput_rps": len(samples) / elapsed if elapsed else None,
+        "elapsed_s": elapsed,
+        "peak_memory_mb": peak_bytes / 1024 / 1024,
+    }
+
+
+def print_report(results, baseline=None):
+    """Print a results table, with p95/throughput changes against a baseline run"""
+    previous = {row["scenario"]: row for row in (baseline or {}).get("results", [])}
+    print(f"\n{'scenario':<8} {'req':>5} {'err':>4} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'ttft50':>7} {'ttft95':>7} {'rps':>8} {'mem MB':>7}")
+    for row in results:
+        line = (
+            f"{row['scenario']:<8} {row['requests']:>5} {row['errors']:>4} "
+            f"{format_stat(row['p50_s'], '7.3f')} {format_stat(row['p95_s'], '7.3f')} {format_stat(row['p99_s'], '7.3f')} "
+            f"{format_stat(row['ttft_p50_s'], '7.3f')} {format_stat(row['ttft_p95_s'], '7.3f')} "
+            f"{format_stat(row['throughput_rps'], '8.2f')} {format_stat(row['peak_memory_mb'], '7.1f')}"
+        )
+        before = previous.get(row["scenario"])
+        if before and before.get("p95_s") and row["p95_s"] and before.get("throughput_rps"):
+            p95_change = (row["p95_s"] / before["p95_s"] - 1) * 100
+            rps_change = (row["throughput_rps"] / before["throughput_rps"] - 1) * 100
+            line += f"   p95 {p95_change:+.1f}%  rps {rps_change:+.1f}%"
+        print(line)
+
+def save_results(report, path=None):
+    """Write a run's results as JSON and return the path"""
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline FableForge benchmark with fake backends")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated scenarios to run ({', '.join(SCENARIOS)})")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario (conversations for chat)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent callers")
+    add_backend_arguments(parser)
+    parser.add_argument("--output", help="Where to save the JSON results (default: a timestamped file)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        print(f"❌ Unknown scenarios: {', '.join(unknown)}")
+        return 1
+
+    config = backend_config_from_args(args)
+    backend = FakeBackend(config)
+    print(f"🏁 Running {', '.join(names)} with {args.requests} requests at concurrency {args.concurrency}")
+    results = []
+    with backend.installed():
+        for name in names:
+            results.append(run_scenario(name, backend, args.requests, args.concurrency))
+            print(f"✅ {name} done in {results[-1]['elapsed_s']:.1f}s")
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "backend": asdict(config),
+        "results": results,
+        "router": get_model_router().metrics(),
+        "metrics": metrics.snapshot(),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    print(f"\n💾 Results saved to {save_results(report, args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
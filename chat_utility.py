@@ -0,0 +1,200 @@
+import os
+from dataclasses import dataclass
+from rate_limiter import PRIORITY_INTERACTIVE, estimate_request_tokens, get_quota_scheduler
+
+CHAT_TOKEN_BUDGET = int(os.getenv("FABLEFORGE_CHAT_TOKEN_BUDGET", "8000"))
+CHAT_KEEP_TURNS = int(os.getenv("FABLEFORGE_CHAT_KEEP_TURNS", "6"))
+CHAT_PAGE_SIZE = int(os.getenv("FABLEFORGE_CHAT_PAGE_SIZE", "20"))
+SUMMARY_PREFIX = "📝 Summary of our earlier conversation:"
+# FinishReason values of a complete reply: unspecified, STOP and MAX_TOKENS
+_COMPLETE_FINISH_REASONS = (0, 1, 2)
+
+
+class ReplyBlockedError(ValueError):
+    """Raised when a streamed reply was stopped early, e.g. for safety or recitation"""
+
+
+@dataclass
+class ChatMessage:
+    """One displayable chat history entry"""
+    role: str
+    text: str
+
+    @classmethod
+    def from_content(cls, content):
+        text = "".join(getattr(part, "text", "") for part in content.parts)
+        return cls(role=content.role, text=text)
+
+
+@dataclass
+class ChatUsage:
+    """Running token totals for a chat session"""
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    total_tokens: int = 0
+    turns: int = 0
+
+    def add(self, usage_metadata):
+        if usage_metadata is None:
+            return
+        self.prompt_tokens += usage_metadata.prompt_token_count
+        self.response_tokens += usage_metadata.candidates_token_count
+        self.total_tokens += usage_metadata.total_token_count
+        self.turns += 1
+
+
+class HistoryView:
+    """Paged view over a chat history that only converts the visible messages.
+
+    Only the newest `pages * page_size` entries are returned; load_older()
+    reveals one more page. Converted messages are cached per position and
+    reused as long as the same Content object is still at that position.
+    """
+
+    def __init__(self, page_size=CHAT_PAGE_SIZE):
+        self.page_size = page_size
+        self.pages = 1
+        self._rendered = {}
+
+    def load_older(self):
+        self.pages += 1
+
+    def reset(self):
+        self.pages = 1
+        self._rendered.clear()
+
+    def visible(self, history):
+        """Return (hidden message count, [ChatMessage]) for the loaded pages"""
+        start = max(len(history) - self.pages * self.page_size, 0)
+        messages = []
+        for index in range(start, len(history)):
+            content = history[index]
+            cached = self._rendered.get(index)
+            if cached is None or cached[0] is not content:
+                cached = self._rendered[index] = (content, ChatMessage.from_content(content))
+            messages.append(cached[1])
+        # Forget positions that are no longer part of the history
+        for index in [index for index in self._rendered if index >= len(history)]:
+            del self._rendered[index]
+        return start, messages
+
+
+def _turn_tokens(chat_session, user_prompt):
+    # The whole history is resent with every turn
+    return estimate_tokens(chat_session.history) + estimate_request_tokens(user_prompt)
+
+def history_messages(chat_session):
+    """Return the session history as ChatMessage entries"""
+    return [ChatMessage.from_content(content) for content in chat_session.history]
+
+def send_chat_message(chat_session, user_prompt, usage=None):
+    """Send one turn through the ChatSession and return the reply text"""
+    response = get_quota_scheduler().run(
+        lambda: chat_session.send_message(user_prompt),
+        _turn_tokens(chat_session, user_prompt),
+        PRIORITY_INTERACTIVE
+    )
+    if usage is not None:
+        usage.add(response.usage_metadata)
+    return response.text
+
+def stream_chat_message(chat_session, user_prompt, usage=None):
+    """Send one turn with stream=True and yield the reply text as it arrives.
+
+    The ChatSession records both the prompt and the full reply in its history
+    once the stream is consumed, so streamed and regular turns share context.
+    A stream that fails partway, or is stopped early for safety or
+    recitation (ReplyBlockedError), is rewound out of the session, so the
+    broken turn does not poison the history for the next message.
+    """
+    response = get_quota_scheduler().run(
+        lambda: chat_session.send_message(user_prompt, stream=True),
+        _turn_tokens(chat_session, user_prompt),
+        PRIORITY_INTERACTIVE
+    )
+    try:
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata only)
+                continue
+            if text:
+                yield text
+        response.resolve()
+        # A blocked stream ends without raising, but the SDK would refuse to read history
+        finish_reason = response.candidates[0].finish_reason if response.candidates else None
+        if finish_reason not in _COMPLETE_FINISH_REASONS:
+            reason = getattr(finish_reason, "name", None) or "BLOCKED"
+            raise ReplyBlockedError(f"The reply was blocked ({reason}). Try rephrasing your message.")
+    except BaseException:
+        # Drops the unfinished turn; history would otherwise raise BrokenResponseError
+        chat_session.rewind()
+        raise
+    if usage is not None:
+        usage.add(response.usage_metadata)
+
+
+def estimate_tokens(contents):
+    """Cheap token estimate (~4 characters per token) that needs no API call"""
+    characters = sum(
+        len(getattr(part, "text", "")) for content in contents for part in content.parts
+    )
+    return characters // 4 + 4 * len(contents)
+
+
+@dataclass
+class CompactionReport:
+    """Outcome of one ChatContextManager.compact() call"""
+    compacted: bool
+    tokens_before: int
+    tokens_after: int
+    saved_this_turn: int
+
+
+class ChatContextManager:
+    """Keep a ChatSession under a token budget by summarizing older turns.
+
+    When the history estimate exceeds `token_budget`, everything except the
+    last `keep_turns` exchanges is replaced by a summary produced with
+    `summarize` (a callable taking a transcript string). Call compact()
+    between turns, never while a streamed reply is still being consumed.
+    """
+
+    def __init__(self, summarize, token_budget=CHAT_TOKEN_BUDGET, keep_turns=CHAT_KEEP_TURNS):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.compactions = 0
+        self.active_savings = 0
+        self.total_saved = 0
+
+    def compact(self, chat_session):
+        """Summarize older turns if over budget and report the tokens saved this turn"""
+        history = list(chat_session.history)
+        tokens_before = estimate_tokens(history)
+        split = max(len(history) - self.keep_turns * 2, 0)
+        older, recent = history[:split], history[split:]
+        compacted = False
+        if tokens_before > self.token_budget and len(older) > 2:
+            transcript = "\n".join(
+                f"{message.role}: {message.text}" for message in map(ChatMessage.from_content, older)
+            )
+            summary = self.summarize(transcript)
+            # The SDK is already loaded here (the session exists); importing late keeps startup fast
+            from google.generativeai import protos
+            compacted_history = [
+                protos.Content(role="user", parts=[protos.Part(text=f"{SUMMARY_PREFIX}\n{summary}")]),
+                protos.Content(role="model", parts=[protos.Part(text="Understood, I'll keep that context in mind.")]),
+            ] + recent
+            tokens_after = estimate_tokens(compacted_history)
+            if tokens_after < tokens_before:
+                chat_session.history = compacted_history
+                self.active_savings += tokens_before - tokens_after
+                self.compactions += 1
+                compacted = True
+        if not compacted:
+            tokens_after = tokens_before
+        # Every turn after a compaction resends that many fewer tokens
+        self.total_saved += self.active_savings
+        return CompactionReport(compacted, tokens_before, tokens_after, self.active_savings)
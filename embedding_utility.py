@@ -0,0 +1,90 @@
+import asyncio
+from dataclasses import dataclass, field
+import numpy as np
+from gemini_async import get_async_engine
+from gemini_utility import get_genai
+from rate_limiter import estimate_request_tokens
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+# batchEmbedContents accepts at most 100 inputs per request
+EMBEDDING_BATCH_SIZE = 100
+# Errors caused by one bad input; anything else (quota, timeouts, auth) fails the whole batch
+_ROW_ERRORS = ("InvalidArgument",)
+
+
+@dataclass
+class EmbeddingBatch:
+    """Row-ordered embedding matrix plus per-row errors.
+
+    Rows that failed are filled with NaN and their error message is stored in
+    `errors` under the row index, so vectors and failures never mix.
+    """
+    vectors: np.ndarray
+    errors: dict = field(default_factory=dict)
+
+    @property
+    def ok(self):
+        """Boolean mask of rows that were embedded successfully"""
+        mask = np.ones(len(self.vectors), dtype=bool)
+        mask[list(self.errors)] = False
+        return mask
+
+    def __len__(self):
+        return len(self.vectors)
+
+
+def _batches(texts, batch_size):
+    for start in range(0, len(texts), batch_size):
+        yield start, texts[start:start + batch_size]
+
+async def _embed_batch(engine, texts, model, task_type, timeout):
+    # One batch is one request against the shared RPM/TPM budget
+    embedding = await engine.run(
+        lambda: get_genai().embed_content_async(model=model, content=texts, task_type=task_type),
+        timeout,
+        estimate_request_tokens(texts)
+    )
+    return embedding["embedding"]
+
+async def _embed_rows(engine, start, texts, model, task_type, timeout):
+    """Embed one batch, isolating bad rows if the batch is rejected for its input"""
+    try:
+        vectors = await _embed_batch(engine, texts, model, task_type, timeout)
+        return [(start + offset, vector, None) for offset, vector in enumerate(vectors)]
+    except Exception as e:
+        if len(texts) == 1 or type(e).__name__ not in _ROW_ERRORS:
+            # Retrying row by row would only repeat the same error len(texts) times
+            return [(start + offset, None, str(e)) for offset in range(len(texts))]
+    rows = await asyncio.gather(*[
+        _embed_rows(engine, start + offset, [text], model, task_type, timeout)
+        for offset, text in enumerate(texts)
+    ])
+    return [row for batch in rows for row in batch]
+
+async def embed_many_async(texts, model=EMBEDDING_MODEL, task_type="retrieval_document",
+                           batch_size=EMBEDDING_BATCH_SIZE, timeout=None):
+    """Embed many texts in provider-sized batches that run concurrently"""
+    texts = list(texts)
+    engine = get_async_engine()
+    results = await asyncio.gather(*[
+        _embed_rows(engine, start, batch, model, task_type, timeout)
+        for start, batch in _batches(texts, batch_size)
+    ])
+
+    rows = [row for batch in results for row in batch]
+    dimension = next((len(vector) for _, vector, _ in rows if vector is not None), 0)
+    vectors = np.full((len(texts), dimension), np.nan, dtype=np.float32)
+    errors = {}
+    for index, vector, error in rows:
+        if error is None:
+            vectors[index] = vector
+        else:
+            errors[index] = error
+    return EmbeddingBatch(vectors=np.ascontiguousarray(vectors), errors=errors)
+
+def embed_many(texts, model=EMBEDDING_MODEL, task_type="retrieval_document",
+               batch_size=EMBEDDING_BATCH_SIZE, timeout=None):
+    """Blocking version of embed_many_async for scripts and Streamlit pages"""
+    engine = get_async_engine()
+    coro = embed_many_async(texts, model, task_type, batch_size, timeout)
+    return asyncio.run_coroutine_threadsafe(coro, engine.loop).result()
@@ -0,0 +1,242 @@
+import io
+import time
+import wave
+import random
+import asyncio
+import threading
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from unittest import mock
+
+import gradio_client
+import google.generativeai as genai
+from google.api_core.exceptions import ServiceUnavailable
+from google.generativeai import protos
+from google.generativeai.types import generation_types
+from gradio_client.utils import Status, StatusUpdate
+
+from tts_utility import TTSClient
+
+EMBEDDING_DIMENSION = 768
+_WORDS = ("once", "upon", "a", "time", "the", "little", "dragon", "flew", "over", "quiet", "hills.")
+
+
+@dataclass
+class FakeBackendConfig:
+    """Latency and failure behaviour of the local stand-in services (seconds)"""
+    latency: float = 0.2
+    jitter: float = 0.05
+    error_rate: float = 0.0
+    chunks: int = 8
+    chunk_interval: float = 0.02
+    words_per_chunk: int = 12
+    tts_latency: float = 0.3
+    video_latency: float = 2.0
+    seed: int = 0
+
+
+class _FakeHTTPResponse:
+    def __init__(self, status_code, content=b"", payload=None):
+        self.status_code = status_code
+        self.content = content
+        self._payload = payload or {}
+
+    def json(self):
+        return self._payload
+
+
+class _FakeTTSSession:
+    """Stands in for the requests.Session used by TTSClient"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def post(self, url, json=None, timeout=None):
+        return self.backend.synthesize(json["inputs"])
+
+    def close(self):
+        pass
+
+
+class _FakeJob(Future):
+    """Future with the status() method of a gradio_client Job"""
+
+    def status(self):
+        return StatusUpdate(
+            code=Status.FINISHED if self.done() else Status.PROCESSING,
+            rank=None, queue_size=None, eta=None, success=None, time=None, progress_data=None,
+        )
+
+
+class FakeGradioClient:
+    """Stands in for gradio_client.Client with predict() and submit()"""
+
+    _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fake-gradio")
+
+    def __init__(self, backend, src=None, **kwargs):
+        self.backend = backend
+        self.src = src
+
+    def predict(self, *args, api_name=None, **kwargs):
+        time.sleep(self.backend.delay(self.backend.config.video_latency))
+        self.backend.maybe_fail()
+        return {"video": b"\x00\x00\x00\x18ftypmp42" + b"\x00" * 1024}
+
+    def submit(self, *args, api_name=None, **kwargs):
+        job = _FakeJob()
+
+        def run():
+            try:
+                job.set_result(self.predict(*args, api_name=api_name, **kwargs))
+            except Exception as e:
+                job.set_exception(e)
+
+        self._executor.submit(run)
+        return job
+
+
+class FakeBackend:
+    """Local Gemini, TTS and Gradio stand-ins with configurable latency, jitter and errors"""
+
+    def __init__(self, config=None):
+        self.config = config or FakeBackendConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.tts = None
+
+    def delay(self, base):
+        with self._lock:
+            return max(0.0, self._random.gauss(base, self.config.jitter))
+
+    def maybe_fail(self):
+        with self._lock:
+            failed = self._random.random() < self.config.error_rate
+        if failed:
+            raise ServiceUnavailable("Fake backend overloaded")
+
+    def _text(self, words):
+        with self._lock:
+            return " ".join(self._random.choice(_WORDS) for _ in range(words)) + " "
+
+    def _chunk(self, text, final):
+        return protos.GenerateContentResponse(
+            candidates=[protos.Candidate(
+                content=protos.Content(role="model", parts=[protos.Part(text=text)]),
+                finish_reason=1 if final else 0,
+            )],
+            usage_metadata=protos.GenerateContentResponse.UsageMetadata(
+                prompt_token_count=64,
+                candidates_token_count=len(text) // 4,
+                total_token_count=64 + len(text) // 4,
+            ),
+        )
+
+    def _stream(self):
+        for index in range(self.config.chunks):
+            if index:
+                time.sleep(self.config.chunk_interval)
+            yield self._chunk(self._text(self.config.words_per_chunk), index == self.config.chunks - 1)
+
+    def generate_content(self, contents, stream=False):
+        time.sleep(self.delay(self.config.latency))
+        self.maybe_fail()
+        if stream:
+            return generation_types.GenerateContentResponse.from_iterator(self._stream())
+        text = self._text(self.config.words_per_chunk * self.config.chunks)
+        return generation_types.GenerateContentResponse.from_response(self._chunk(text, True))
+
+    async def generate_content_async(self, contents):
+        await asyncio.sleep(self.delay(self.config.latency))
+        self.maybe_fail()
+        text = self._text(self.config.words_per_chunk * self.config.chunks)
+        return generation_types.AsyncGenerateContentResponse.from_response(self._chunk(text, True))
+
+    @staticmethod
+    def _vector(text):
+        # Deterministic per text, so identical prompts embed identically
+        generator = random.Random(text)
+        return [generator.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSION)]
+
+    def embed_content(self, model=None, content=None, task_type=None, **kwargs):
+        time.sleep(self.delay(self.config.latency / 4))
+        self.maybe_fail()
+        if isinstance(content, str):
+            return {"embedding": self._vector(content)}
+        return {"embedding": [self._vector(text) for text in content]}
+
+    def synthesize(self, text):
+        time.sleep(self.delay(self.config.tts_latency))
+        with self._lock:
+            failed = self._random.random() < self.config.error_rate
+        if failed:
+            return _FakeHTTPResponse(503, payload={"estimated_time": 0.1})
+        # 16 kHz mono silence, about 60 ms per character
+        output = io.BytesIO()
+        with wave.open(output, "wb") as writer:
+            writer.setnchannels(1)
+            writer.setsampwidth(2)
+            writer.setframerate(16000)
+            writer.writeframes(b"\x00\x00" * 960 * len(text))
+        return _FakeHTTPResponse(200, output.getvalue())
+
+    def tts_client(self):
+        """Return a TTSClient whose requests go to the fake TTS endpoint"""
+        client = TTSClient("benchmark", backoff=0.05)
+        client.session.close()
+        client.session = _FakeTTSSession(self)
+        return client
+
+    @contextmanager
+    def installed(self):
+        """Patch google.generativeai and gradio_client to use this backend"""
+        backend = self
+
+        def generate_content(model, contents, stream=False, **kwargs):
+            return backend.generate_content(contents, stream)
+
+        async def generate_content_async(model, contents, **kwargs):
+            return await backend.generate_content_async(contents)
+
+        async def embed_content_async(**kwargs):
+            return await asyncio.to_thread(backend.embed_content, **kwargs)
+
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(genai.GenerativeModel, "generate_content", generate_content))
+            stack.enter_context(mock.patch.object(
+                genai.GenerativeModel, "generate_content_async", generate_content_async
+            ))
+            stack.enter_context(mock.patch.object(genai, "embed_content", backend.embed_content))
+            stack.enter_context(mock.patch.object(genai, "embed_content_async", embed_content_async))
+            stack.enter_context(mock.patch.object(genai, "list_models", lambda: []))
+            stack.enter_context(mock.patch.object(genai, "get_model", lambda name: name))
+            stack.enter_context(mock.patch.object(
+                gradio_client, "Client", lambda src=None, **kwargs: FakeGradioClient(backend, src, **kwargs)
+            ))
+            self.tts = self.tts_client()
+            stack.callback(self.tts.close)
+            yield self
+
+
+def add_backend_arguments(parser):
+    """Add the fake backend's latency and failure options to an argparse parser"""
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake Gemini latency to first byte (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Standard deviation added to every fake latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake calls that fail with 503")
+    parser.add_argument("--chunks", type=int, default=8, help="Streamed chunks per fake response")
+    parser.add_argument("--chunk-interval", type=float, default=0.02, help="Seconds between streamed chunks")
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="Fake TTS latency per request (seconds)")
+    parser.add_argument("--video-latency", type=float, default=2.0, help="Fake Gradio video latency (seconds)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for jitter and errors")
+
+def backend_config_from_args(args):
+    return FakeBackendConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        chunks=args.chunks,
+        chunk_interval=args.chunk_interval,
+        tts_latency=args.tts_latency,
+        video_latency=args.video_latency,
+        seed=args.seed,
+    )
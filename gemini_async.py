@@ -0,0 +1,157 @@
+import os
+import time
+import asyncio
+import threading
+from gemini_utility import get_genai, load_model_for_task
+from generation_result import GenerationResult, usage_from_metadata
+from rate_limiter import PRIORITY_DEFAULT, estimate_request_tokens, get_quota_scheduler, task_priority
+
+MAX_CONCURRENCY = int(os.getenv("FABLEFORGE_MAX_CONCURRENCY", "8"))
+REQUEST_TIMEOUT = float(os.getenv("FABLEFORGE_REQUEST_TIMEOUT", "60"))
+
+
+class AsyncGenerationEngine:
+    """Run Gemini calls on one shared event loop behind a global concurrency limit.
+
+    The engine owns a daemon thread running its event loop. Coroutines awaited
+    from any other loop (or submitted from plain threads such as Streamlit
+    scripts) are forwarded to it, so every session and batch job shares the
+    same semaphore instead of spawning its own threads. Each call first waits
+    for capacity from the shared QuotaScheduler, so async and threaded
+    callers draw on one RPM/TPM budget.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, timeout=REQUEST_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.in_flight = 0
+        self._loop = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """Return the engine's event loop, starting its thread on first use"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    ready.set()
+                    loop.run_forever()
+
+                threading.Thread(target=run, name="gemini-async-engine", daemon=True).start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    async def _limited(self, coro_factory, timeout, tokens, priority):
+        # Quota is taken before a concurrency slot, so waiting calls don't hold slots
+        await asyncio.to_thread(get_quota_scheduler().acquire, tokens, priority)
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                return await asyncio.wait_for(coro_factory(), timeout)
+            finally:
+                self.in_flight -= 1
+
+    def submit(self, coro_factory, timeout=None, tokens=1, priority=PRIORITY_DEFAULT):
+        """Schedule a call from any thread and return a concurrent.futures.Future
+
+        `tokens` and `priority` are what the call asks of the quota scheduler;
+        `timeout` only covers the call itself, not the wait for quota.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        return asyncio.run_coroutine_threadsafe(
+            self._limited(coro_factory, timeout, tokens, priority), self.loop
+        )
+
+    async def run(self, coro_factory, timeout=None, tokens=1, priority=PRIORITY_DEFAULT):
+        """Await a call on the engine loop; cancelling the caller cancels the call"""
+        future = self.submit(coro_factory, timeout, tokens, priority)
+        return await asyncio.wrap_future(future)
+
+    def run_sync(self, coro_factory, timeout=None, tokens=1, priority=PRIORITY_DEFAULT):
+        """Block the calling thread until the call finishes"""
+        return self.submit(coro_factory, timeout, tokens, priority).result()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_async_engine():
+    """Return the process-wide async generation engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncGenerationEngine()
+        return _engine
+
+async def _generate_async(model, generation_config, contents, timeout, message, priority):
+    start = time.perf_counter()
+    tokens = estimate_request_tokens(contents, generation_config.get("max_output_tokens", 0))
+    try:
+        response = await get_async_engine().run(
+            lambda: model.generate_content_async(contents), timeout, tokens, priority
+        )
+        return GenerationResult(
+            text=response.text,
+            model=model.model_name,
+            latency=time.perf_counter() - start,
+            usage=usage_from_metadata(getattr(response, "usage_metadata", None)),
+        )
+    except asyncio.TimeoutError:
+        return GenerationResult.failure(
+            TimeoutError("request timed out"), message, model.model_name, time.perf_counter() - start
+        )
+    except Exception as e:
+        return GenerationResult.failure(e, message, model.model_name, time.perf_counter() - start)
+
+async def gemini_pro_response_async(user_prompt, timeout=None, task=None, overrides=None):
+    """Async version of gemini_pro_response"""
+    gemini_pro_model, generation_config = load_model_for_task(task, overrides)
+    return await _generate_async(
+        gemini_pro_model, generation_config, user_prompt, timeout, "Error generating response",
+        task_priority(task)
+    )
+
+async def gemini_pro_vision_response_async(prompt, image, timeout=None, task="image_story", overrides=None):
+    """Async version of gemini_pro_vision_response"""
+    gemini_pro_vision_model, generation_config = load_model_for_task(task, overrides)
+    return await _generate_async(
+        gemini_pro_vision_model, generation_config, [prompt, image], timeout,
+        "Error generating vision response", task_priority(task)
+    )
+
+async def embeddings_model_response_async(input_text, timeout=None):
+    """Async version of embeddings_model_response"""
+    engine = get_async_engine()
+    start = time.perf_counter()
+    # Use the latest embedding model, falling back to the older one
+    for embedding_model in ("models/text-embedding-004", "models/embedding-001"):
+        try:
+            embedding = await engine.run(
+                lambda: get_genai().embed_content_async(
+                    model=embedding_model,
+                    content=input_text,
+                    task_type="retrieval_document"
+                ),
+                timeout,
+                estimate_request_tokens(input_text)
+            )
+            return GenerationResult(
+                model=embedding_model,
+                latency=time.perf_counter() - start,
+                embedding=embedding["embedding"]
+            )
+        except asyncio.TimeoutError:
+            error = TimeoutError("request timed out")
+        except Exception as e:
+            error = e
+        print(f"Error generating embeddings with {embedding_model}: {error}")
+    return GenerationResult.failure(
+        error, "Error generating embeddings", embedding_model, time.perf_counter() - start
+    )
@@ -1,108 +1,435 @@
-import os
-import time
-from dotenv import load_dotenv
-from PIL import Image
-import google.generativeai as genai
-
-# Load environment variables
-load_dotenv()
-
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-# Configure Google.generativeai with API key
-genai.configure(api_key=GOOGLE_API_KEY)
-
-def load_gemini_pro_model():
-    """Load the latest Gemini 2.0 Flash model for better performance"""
-    try:
-        gemini_pro_model = genai.GenerativeModel("gemini-2.0-flash")
-        return gemini_pro_model
-    except Exception as e:
-        # Fallback to 1.5 flash if 2.0 is not available
-        print(f"Warning: Could not load gemini-2.0-flash, falling back to gemini-1.5-flash. Error: {e}")
-        return genai.GenerativeModel("gemini-1.5-flash")
-
-def load_gemini_pro_vision_model():
-    """Load the latest Gemini vision model"""
-    try:
-        return genai.GenerativeModel("gemini-2.0-flash")
-    except Exception as e:
-        print(f"Warning: Could not load gemini-2.0-flash for vision, falling back to gemini-1.5-flash. Error: {e}")
-        return genai.GenerativeModel("gemini-1.5-flash")
-
-def gemini_pro_vision_response(prompt, image):
-    """Get response from Gemini Vision model - image/text to text"""
-    try:
-        gemini_pro_vision_model = load_gemini_pro_vision_model()
-        response = gemini_pro_vision_model.generate_content([prompt, image])
-        result = response.text
-        return result
-    except Exception as e:
-        return f"Error generating vision response: {str(e)}"
-
-def embeddings_model_response(input_text):
-    """Get response from embeddings model - text to embeddings"""
-    try:
-        # Use the latest embedding model
-        embedding_model = "models/text-embedding-004"
-        embedding = genai.embed_content(
-            model=embedding_model,
-            content=input_text,
-            task_type="retrieval_document"
-        )
-        embedding_list = embedding["embedding"]
-        return embedding_list
-    except Exception as e:
-        print(f"Error generating embeddings: {e}")
-        # Fallback to older model
-        try:
-            embedding_model = "models/embedding-001"
-            embedding = genai.embed_content(
-                model=embedding_model,
-                content=input_text,
-                task_type="retrieval_document"
-            )
-            embedding_list = embedding["embedding"]
-            return embedding_list
-        except Exception as fallback_e:
-            return f"Error generating embeddings: {str(fallback_e)}"
-
-def gemini_pro_response(user_prompt):
-    """Get response from Gemini model - text to text"""
-    try:
-        gemini_pro_model = load_gemini_pro_model()
-        response = gemini_pro_model.generate_content(user_prompt)
-        result = response.text
-        return result
-    except Exception as e:
-        return f"Error generating response: {str(e)}"
-
-def gemini_stream_response(user_prompt):
-    """Get streaming response from Gemini model"""
-    try:
-        gemini_pro_model = load_gemini_pro_model()
-        response = gemini_pro_model.generate_content(user_prompt, stream=True)
-        return response
-    except Exception as e:
-        return f"Error generating streaming response: {str(e)}"
-
-def get_available_models():
-    """Get list of available Gemini models"""
-    try:
-        models = []
-        for model in genai.list_models():
-            if 'generateContent' in model.supported_generation_methods:
-                models.append(model.name)
-        return models
-    except Exception as e:
-        print(f"Error fetching models: {e}")
-        return ["gemini-2.0-flash", "gemini-1.5-flash", "gemini-1.5-pro"]
-
-def check_api_key():
-    """Check if API key is valid"""
-    try:
-        models = list(genai.list_models())
-        return True
-    except Exception as e:
-        print(f"API key validation failed: {e}")
-        return False
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from instrumentation import instrument_result, metrics, timed
+from response_cache import ResponseCache, get_response_cache, image_digest
+from generation_result import GenerationResult, GenerationStream, should_fail_over, usage_from_metadata
+from generation_profiles import AUTO_MODEL, resolve_profile
+from model_router import get_model_router
+from rate_limiter import (
+    PRIORITY_INTERACTIVE,
+    estimate_request_tokens,
+    get_quota_scheduler,
+    task_priority
+)
+
+# Load environment variables
+load_dotenv()
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+_genai = None
+_genai_lock = threading.Lock()
+
+def get_genai():
+    """Import and configure google.generativeai on first use.
+
+    The SDK takes about a second to import, so it is loaded when the first
+    model is built or the first probe runs, not when this module is imported.
+    """
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=GOOGLE_API_KEY)
+            _genai = genai
+        return _genai
+
+class ModelRegistry:
+    """Thread-safe cache of GenerativeModel instances keyed by (model name, generation config)"""
+
+    def __init__(self, fallback_model="gemini-1.5-flash"):
+        self.fallback_model = fallback_model
+        self._models = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _config_key(generation_config):
+        if not generation_config:
+            return ()
+        if not isinstance(generation_config, dict):
+            generation_config = {
+                key: value for key, value in vars(generation_config).items()
+                if value is not None
+            }
+        return tuple(sorted((key, repr(value)) for key, value in generation_config.items()))
+
+    def get(self, model_name, generation_config=None):
+        """Return the cached model for this name/config, building it on first use"""
+        key = (model_name, self._config_key(generation_config))
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self.hits += 1
+                return model
+            self.misses += 1
+            genai = get_genai()
+            with timed("model_construction"):
+                try:
+                    model = genai.GenerativeModel(model_name, generation_config=generation_config)
+                except Exception as e:
+                    # Fallback to 1.5 flash if the requested model is not available
+                    print(f"Warning: Could not load {model_name}, falling back to {self.fallback_model}. Error: {e}")
+                    model = genai.GenerativeModel(self.fallback_model, generation_config=generation_config)
+            self._models[key] = model
+            return model
+
+    def stats(self):
+        """Return hit/miss counters and the number of cached models"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "models": len(self._models)}
+
+    def clear(self):
+        """Drop every cached model (counters are kept)"""
+        with self._lock:
+            self._models.clear()
+
+
+# One registry per process, shared by every Streamlit session. It is a module
+# global rather than st.cache_resource so generation code and CLI scripts use
+# the same cache without importing streamlit.
+_model_registry = ModelRegistry()
+
+def get_model_registry():
+    """Return the process-wide model registry that every generation path uses"""
+    return _model_registry
+
+def load_gemini_pro_model():
+    """Load the latest Gemini 2.0 Flash model for better performance"""
+    return _model_registry.get("gemini-2.0-flash")
+
+def load_gemini_pro_vision_model():
+    """Load the latest Gemini vision model"""
+    return _model_registry.get("gemini-2.0-flash")
+
+def load_model_for_task(task=None, overrides=None):
+    """Return (model, generation config) for a task profile plus sidebar overrides"""
+    model_name, generation_config = resolve_profile(task, overrides)
+    return _model_registry.get(model_name, generation_config), generation_config
+
+def _is_pinned(overrides):
+    """True when the user explicitly picked a model in the sidebar"""
+    return bool(overrides) and overrides.get("model") not in (None, AUTO_MODEL)
+
+def _cache_get(cache_key):
+    """Cached text for `cache_key`, or None; a broken cache only costs the hit"""
+    try:
+        return get_response_cache().get(cache_key)
+    except Exception as e:
+        print(f"Response cache read failed: {e}")
+        metrics.increment("response_cache_errors", operation="get")
+        return None
+
+def _cache_set(cache_key, text):
+    """Store a fresh response; errors (locked or read-only database) are logged, not raised"""
+    try:
+        get_response_cache().set(cache_key, text)
+    except Exception as e:
+        print(f"Response cache write failed: {e}")
+        metrics.increment("response_cache_errors", operation="set")
+
+def _routed_generate(task, model_name, generation_config, contents, pinned, priority=None):
+    """Generate on the model the router picks, with hedging and failover.
+
+    Every attempt waits for shared RPM/TPM quota (at `priority`, or the
+    task's priority) and retries 429/503 errors with jittered backoff before
+    the router counts it as a failure. Returns a GenerationResult; only
+    transient and model-not-found errors fail over to another model.
+    """
+    scheduler = get_quota_scheduler()
+    if priority is None:
+        priority = task_priority(task)
+    tokens = estimate_request_tokens(contents, generation_config.get("max_output_tokens", 0))
+
+    def generate(candidate, attempt):
+        model = _model_registry.get(candidate, generation_config)
+        # A hedge that loses while still waiting for quota is never sent; only
+        # attempt.send() is timed, so quota waits don't count as model latency
+        response = scheduler.run(
+            lambda: attempt.send(lambda: model.generate_content(contents)),
+            tokens,
+            priority,
+            cancel=attempt.cancel
+        )
+        # response.text raises ValueError when the reply was blocked
+        return GenerationResult(
+            text=response.text,
+            model=candidate,
+            usage=usage_from_metadata(getattr(response, "usage_metadata", None)),
+        )
+
+    start = time.perf_counter()
+    result = get_model_router().call(task, model_name, generate, pinned, should_failover=should_fail_over)
+    result.latency = time.perf_counter() - start
+    return result
+
+@instrument_result("gemini_pro_vision_response")
+def gemini_pro_vision_response(prompt, image, use_cache=True, task="image_story", overrides=None,
+                               priority=None):
+    """Get response from Gemini Vision model - image/text to text
+
+    `priority` overrides the task's quota priority, e.g. PRIORITY_BULK for
+    batch jobs that should yield to interactive users.
+    """
+    model_name = None
+    start = time.perf_counter()
+    try:
+        model_name, generation_config = resolve_profile(task, overrides)
+        cache_key = ResponseCache.make_key(model_name, prompt, image_digest(image), generation_config)
+        if use_cache:
+            cached = _cache_get(cache_key)
+            if cached is not None:
+                return GenerationResult(text=cached, model=model_name, cached=True)
+        result = _routed_generate(
+            task, model_name, generation_config, [prompt, image], _is_pinned(overrides), priority
+        )
+        _cache_set(cache_key, result.text)
+        return result
+    except Exception as e:
+        return GenerationResult.failure(
+            e, "Error generating vision response", model_name, time.perf_counter() - start
+        )
+
+@instrument_result("embeddings_model_response")
+def embeddings_model_response(input_text):
+    """Get response from embeddings model - text to embeddings
+
+    The vector is returned in `GenerationResult.embedding`.
+    """
+    start = time.perf_counter()
+    # Use the latest embedding model, falling back to the older one
+    for embedding_model in ("models/text-embedding-004", "models/embedding-001"):
+        try:
+            embedding = get_quota_scheduler().run(
+                lambda: get_genai().embed_content(
+                    model=embedding_model,
+                    content=input_text,
+                    task_type="retrieval_document"
+                ),
+                estimate_request_tokens(input_text)
+            )
+            return GenerationResult(
+                model=embedding_model,
+                latency=time.perf_counter() - start,
+                embedding=embedding["embedding"]
+            )
+        except Exception as e:
+            print(f"Error generating embeddings with {embedding_model}: {e}")
+            error = e
+    return GenerationResult.failure(
+        error, "Error generating embeddings", embedding_model, time.perf_counter() - start
+    )
+
+def _embedding_vector(input_text):
+    result = embeddings_model_response(input_text)
+    return result.embedding if result.ok else None
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+def get_semantic_cache():
+    """Return the process-wide semantic prompt cache"""
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            # Deferred: the cache pulls in NumPy
+            from semantic_cache import SemanticCache
+            _semantic_cache = SemanticCache(_embedding_vector)
+        return _semantic_cache
+
+def semantic_cache_stats():
+    """Stats of the semantic cache, or None if nothing has used it yet"""
+    with _semantic_cache_lock:
+        cache = _semantic_cache
+    return cache.stats() if cache is not None else None
+
+@instrument_result("gemini_pro_response")
+def gemini_pro_response(user_prompt, use_cache=True, semantic_scope=None, semantic_text=None,
+                        task=None, overrides=None, priority=None):
+    """Get response from Gemini model - text to text
+
+    `task` picks a generation profile (model + GenerationConfig) and
+    `overrides` carries the sidebar model/temperature/max_tokens.
+    `priority` overrides the task's quota priority. When
+    `semantic_scope` is given, near-duplicate requests in the same scope
+    are answered from the semantic cache. `semantic_text` is what gets
+    embedded (defaults to the prompt); pass the user's own words so the
+    shared template text does not dominate the similarity.
+    """
+    model_name = None
+    start = time.perf_counter()
+    try:
+        model_name, generation_config = resolve_profile(task, overrides)
+        cache_key = ResponseCache.make_key(model_name, user_prompt, generation_config=generation_config)
+        semantic_vector = None
+        if semantic_scope is not None:
+            semantic_scope = (model_name, tuple(sorted(generation_config.items())), semantic_scope)
+            semantic_text = semantic_text or user_prompt
+        if use_cache:
+            cached = _cache_get(cache_key)
+            if cached is None and semantic_scope is not None:
+                cached, semantic_vector = get_semantic_cache().lookup(semantic_text, semantic_scope)
+            if cached is not None:
+                return GenerationResult(
+                    text=cached, model=model_name, latency=time.perf_counter() - start, cached=True
+                )
+        result = _routed_generate(
+            task, model_name, generation_config, user_prompt, _is_pinned(overrides), priority
+        )
+        _cache_set(cache_key, result.text)
+        if semantic_scope is not None:
+            get_semantic_cache().store(
+                semantic_text, semantic_scope, result.text, result.latency, semantic_vector
+            )
+        return result
+    except Exception as e:
+        return GenerationResult.failure(
+            e, "Error generating response", model_name, time.perf_counter() - start
+        )
+
+@timed("summarize_transcript")
+def summarize_transcript(transcript):
+    """Summarize older chat turns with a small, cheap model"""
+    summary_model, _ = load_model_for_task("chat_summary")
+    prompt = (
+        "Summarize this conversation in a few short bullet points. Keep names, facts, "
+        "decisions and open questions the assistant will need later:\n\n" + transcript
+    )
+    response = get_quota_scheduler().run(
+        lambda: summary_model.generate_content(prompt),
+        estimate_request_tokens(prompt),
+        PRIORITY_INTERACTIVE
+    )
+    return response.text
+
+@timed("gemini_stream_response_start")
+def gemini_stream_response(user_prompt, task=None, overrides=None, image=None, cancel=None):
+    """Get streaming response from Gemini model
+
+    Returns a GenerationStream that yields text chunks; check `.ok` before
+    iterating and read `.result` once the stream is consumed. Pass `image`
+    to stream a vision response. When the optional `cancel` event is set
+    while the request waits for quota, it is never sent.
+    """
+    model_name = None
+    contents = user_prompt if image is None else [user_prompt, image]
+    try:
+        model_name, generation_config = resolve_profile(task, overrides)
+        # Streams cannot be hedged, so only the routing decision applies here
+        model_name = get_model_router().route(task, model_name, _is_pinned(overrides))[0]
+        gemini_pro_model = _model_registry.get(model_name, generation_config)
+        response = get_quota_scheduler().run(
+            lambda: gemini_pro_model.generate_content(contents, stream=True),
+            estimate_request_tokens(contents, generation_config.get("max_output_tokens", 0)),
+            task_priority(task),
+            cancel=cancel
+        )
+        return GenerationStream(response, model_name)
+    except Exception as e:
+        return GenerationStream(model=model_name, error=e)
+
+class BackgroundRefreshCache:
+    """Single cached value with a TTL that refreshes in the background.
+
+    The first call blocks on the loader. Once the value is older than the TTL
+    the stale value keeps being served while one background thread reloads it.
+    """
+
+    def __init__(self, loader, ttl):
+        self.loader = loader
+        self.ttl = ttl
+        self._value = None
+        self._loaded_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            value = self.loader()
+            with self._lock:
+                self._value = value
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_in_background(self):
+        if not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh, daemon=True).start()
+
+    def get(self, wait=True):
+        """Return the cached value, loading it synchronously only on first use.
+
+        With wait=False the first load also runs in the background and None
+        is returned until it has finished.
+        """
+        with self._lock:
+            loaded_at = self._loaded_at
+            if loaded_at is not None:
+                if time.monotonic() - loaded_at > self.ttl:
+                    self._refresh_in_background()
+                return self._value
+            if not wait:
+                self._refresh_in_background()
+                return None
+        value = self.loader()
+        with self._lock:
+            if self._loaded_at is None:
+                self._value = value
+                self._loaded_at = time.monotonic()
+            return self._value
+
+    def invalidate(self):
+        """Force the next get() to reload synchronously"""
+        with self._lock:
+            self._value = None
+            self._loaded_at = None
+
+
+CATALOG_TTL = float(os.getenv("FABLEFORGE_CATALOG_TTL", "600"))
+HEALTH_TTL = float(os.getenv("FABLEFORGE_HEALTH_TTL", "120"))
+FALLBACK_MODELS = ["gemini-2.0-flash", "gemini-1.5-flash", "gemini-1.5-pro"]
+
+@timed("list_models")
+def _list_generation_models():
+    try:
+        models = []
+        for model in get_genai().list_models():
+            if 'generateContent' in model.supported_generation_methods:
+                models.append(model.name)
+        return models
+    except Exception as e:
+        print(f"Error fetching models: {e}")
+        return list(FALLBACK_MODELS)
+
+@timed("api_health_probe")
+def _probe_api_key():
+    try:
+        # A single model lookup is enough to validate the key
+        get_genai().get_model("models/gemini-2.0-flash")
+        return True
+    except Exception as e:
+        print(f"API key validation failed: {e}")
+        return False
+
+_model_catalog = BackgroundRefreshCache(_list_generation_models, CATALOG_TTL)
+_api_health = BackgroundRefreshCache(_probe_api_key, HEALTH_TTL)
+
+def get_available_models(wait=True):
+    """Get list of available Gemini models (shared, TTL-cached).
+
+    With wait=False the fallback list is returned while the catalog loads.
+    """
+    models = _model_catalog.get(wait)
+    return list(models if models is not None else FALLBACK_MODELS)
+
+def check_api_key(wait=True):
+    """Check if API key is valid (shared, TTL-cached health probe).
+
+    With wait=False, returns None while the first probe is still running.
+    """
+    return _api_health.get(wait)
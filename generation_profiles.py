@@ -0,0 +1,69 @@
+import os
+from dataclasses import dataclass
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+SMALL_MODEL = os.getenv("FABLEFORGE_SMALL_MODEL", "gemini-1.5-flash-8b")
+SUMMARY_MODEL = os.getenv("FABLEFORGE_SUMMARY_MODEL", SMALL_MODEL)
+AUTO_MODEL = "Auto (per task)"
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """Default model and generation settings for one page or task"""
+    model: str
+    temperature: float
+    max_output_tokens: int
+
+    def generation_config(self, temperature=None, max_tokens=None):
+        """Build a GenerationConfig dict, applying sidebar overrides.
+
+        The temperature override replaces the profile value; max_tokens can
+        only tighten the profile's output cap, never raise it.
+        """
+        max_output_tokens = self.max_output_tokens
+        if max_tokens is not None:
+            max_output_tokens = min(max_output_tokens, int(max_tokens))
+        return {
+            "temperature": self.temperature if temperature is None else float(temperature),
+            "max_output_tokens": max_output_tokens,
+        }
+
+
+PROFILES = {
+    "default": GenerationProfile(DEFAULT_MODEL, 0.7, 2048),
+    "chat": GenerationProfile(DEFAULT_MODEL, 0.7, 2048),
+    "chat_summary": GenerationProfile(SUMMARY_MODEL, 0.2, 512),
+    "image_story": GenerationProfile(DEFAULT_MODEL, 0.9, 2048),
+    "text_story": GenerationProfile(DEFAULT_MODEL, 0.9, 2048),
+    "novella_outline": GenerationProfile(DEFAULT_MODEL, 0.8, 1024),
+    "novella_chapter": GenerationProfile(DEFAULT_MODEL, 0.9, 4096),
+    "chapter_summary": GenerationProfile(SUMMARY_MODEL, 0.2, 256),
+    "poem": GenerationProfile(DEFAULT_MODEL, 0.9, 768),
+    "haiku": GenerationProfile(SMALL_MODEL, 0.8, 128),
+    "comic_preview": GenerationProfile(DEFAULT_MODEL, 0.8, 1024),
+    "improve_text": GenerationProfile(DEFAULT_MODEL, 0.4, 2048),
+    "grammar_check": GenerationProfile(SMALL_MODEL, 0.1, 1024),
+    "summarize": GenerationProfile(SMALL_MODEL, 0.3, 512),
+    "translate": GenerationProfile(DEFAULT_MODEL, 0.2, 2048),
+    "change_tone": GenerationProfile(DEFAULT_MODEL, 0.5, 2048),
+    "expand_ideas": GenerationProfile(DEFAULT_MODEL, 0.8, 2048),
+}
+
+
+def task_key(label):
+    """Turn a UI label such as "Grammar Check" into a profile key"""
+    return label.strip().lower().replace(" ", "_")
+
+def resolve_profile(task=None, overrides=None):
+    """Return (model name, generation config dict) for a task plus sidebar overrides.
+
+    `overrides` may contain "model", "temperature" and "max_tokens"; a missing
+    value or the AUTO_MODEL sentinel keeps the profile default.
+    """
+    profile = PROFILES.get(task or "default", PROFILES["default"])
+    overrides = overrides or {}
+    model_name = overrides.get("model")
+    if not model_name or model_name == AUTO_MODEL:
+        model_name = profile.model
+    config = profile.generation_config(overrides.get("temperature"), overrides.get("max_tokens"))
+    return model_name, config
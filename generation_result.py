@@ -0,0 +1,128 @@
+import time
+from dataclasses import dataclass, field
+from instrumentation import metrics, record_io
+from rate_limiter import RateLimitTimeout, is_rate_limit_error
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+_TRANSIENT_ERRORS = (
+    "DeadlineExceeded",
+    "InternalServerError",
+    "ServiceUnavailable",
+    "ResourceExhausted",
+    "TooManyRequests",
+    "Aborted",
+    "Unknown",
+)
+
+# The model name is unknown or retired for this key; another model can still answer
+_MODEL_UNAVAILABLE_ERRORS = (
+    "NotFound",
+)
+
+
+def classify_error(error):
+    """Return TRANSIENT for errors worth retrying (quota, timeouts, 5xx), else PERMANENT"""
+    if isinstance(error, (TimeoutError, ConnectionError, RateLimitTimeout)):
+        return TRANSIENT
+    if is_rate_limit_error(error) or type(error).__name__ in _TRANSIENT_ERRORS:
+        return TRANSIENT
+    return PERMANENT
+
+def is_transient(error):
+    return classify_error(error) == TRANSIENT
+
+def should_fail_over(error):
+    """True for errors another model may not hit: transient ones, or this model being unavailable"""
+    return is_transient(error) or type(error).__name__ in _MODEL_UNAVAILABLE_ERRORS
+
+def usage_from_metadata(usage_metadata):
+    """Convert a response's usage_metadata into a plain dict"""
+    if not usage_metadata:
+        return {}
+    return {
+        "prompt_tokens": usage_metadata.prompt_token_count,
+        "response_tokens": usage_metadata.candidates_token_count,
+        "total_tokens": usage_metadata.total_token_count,
+    }
+
+
+@dataclass
+class GenerationResult:
+    """Outcome of a generation or embedding call.
+
+    Failures carry `error` and `error_kind` instead of putting an error
+    message in `text`, so callers never show, narrate or cache them.
+    """
+    text: str = ""
+    model: str = None
+    latency: float = 0.0
+    usage: dict = field(default_factory=dict)
+    error: str = None
+    error_kind: str = None
+    cached: bool = False
+    embedding: list = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def transient(self):
+        return self.error_kind == TRANSIENT
+
+    @classmethod
+    def failure(cls, error, message, model=None, latency=0.0):
+        """Build a failed result from an exception"""
+        return cls(
+            model=model,
+            latency=latency,
+            error=f"{message}: {str(error)}",
+            error_kind=classify_error(error),
+        )
+
+
+class GenerationStream:
+    """Iterate over streamed text; the final GenerationResult is in `result` afterwards"""
+
+    def __init__(self, response=None, model=None, error=None, message="Error generating streaming response"):
+        self._response = response
+        self._message = message
+        self._started_at = time.perf_counter()
+        self.result = GenerationResult(model=model)
+        if error is not None:
+            self.result = GenerationResult.failure(error, message, model)
+
+    @property
+    def ok(self):
+        return self.result.ok
+
+    @property
+    def error(self):
+        return self.result.error
+
+    def __iter__(self):
+        if self._response is None:
+            return
+        chunks = []
+        try:
+            for chunk in self._response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. safety metadata only)
+                    continue
+                chunks.append(text)
+                yield text
+            self.result.usage = usage_from_metadata(getattr(self._response, "usage_metadata", None))
+        except Exception as e:
+            failure = GenerationResult.failure(e, self._message, self.result.model)
+            self.result.error, self.result.error_kind = failure.error, failure.error_kind
+        finally:
+            self._response = None
+            self.result.text = "".join(chunks)
+            self.result.latency = time.perf_counter() - self._started_at
+            metrics.observe("gemini_stream_response", self.result.latency)
+            record_io("gemini_stream_response", received=len(self.result.text.encode("utf-8")),
+                      usage=self.result.usage)
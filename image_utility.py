@@ -0,0 +1,77 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from PIL import Image, ImageOps
+
+IMAGE_MAX_EDGE = int(os.getenv("FABLEFORGE_IMAGE_MAX_EDGE", "1536"))
+IMAGE_FORMAT = os.getenv("FABLEFORGE_IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("FABLEFORGE_IMAGE_QUALITY", "85"))
+IMAGE_CACHE_ITEMS = 32
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+@dataclass
+class PreparedImage:
+    """An upload after orientation fix, resize and re-encode"""
+    image: Image.Image
+    data: bytes
+    mime_type: str
+    digest: str
+    original_size: int
+
+    @property
+    def blob(self):
+        """Inline blob accepted by GenerativeModel.generate_content"""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+    @property
+    def saved_ratio(self):
+        """Fraction of upload bytes removed by preprocessing"""
+        if not self.original_size:
+            return 0.0
+        return max(1 - len(self.data) / self.original_size, 0.0)
+
+
+def preprocess_image(data, max_edge=IMAGE_MAX_EDGE, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    """Apply EXIF orientation, cap the longest edge, convert to RGB and re-encode"""
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=quality, optimize=True)
+    encoded = buffer.getvalue()
+    return PreparedImage(
+        image=image,
+        data=encoded,
+        mime_type=MIME_TYPES[image_format],
+        digest=hashlib.sha256(encoded).hexdigest(),
+        original_size=len(data),
+    )
+
+
+_prepared_images = OrderedDict()
+_prepared_images_lock = threading.Lock()
+
+def prepare_upload(data, max_edge=IMAGE_MAX_EDGE, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    """Preprocess an upload once per content hash, so reruns skip the decode"""
+    key = (hashlib.sha256(data).hexdigest(), max_edge, image_format, quality)
+    with _prepared_images_lock:
+        prepared = _prepared_images.get(key)
+        if prepared is not None:
+            _prepared_images.move_to_end(key)
+            return prepared
+    prepared = preprocess_image(data, max_edge, image_format, quality)
+    with _prepared_images_lock:
+        _prepared_images[key] = prepared
+        while len(_prepared_images) > IMAGE_CACHE_ITEMS:
+            _prepared_images.popitem(last=False)
+    return prepared
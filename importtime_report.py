@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+FableForge AI Story Engine - Startup Import Report
+Measures what main.py imports before the first paint, using `python -X importtime`
+in a fresh interpreter. Modules that streamlit itself already loads are left
+out, so the numbers are the app's own cold-start cost.
+
+Usage:
+    python importtime_report.py
+    python importtime_report.py --output startup.json
+    python importtime_report.py --compare startup.json --budget 250
+"""
+
+import os
+import re
+import ast
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+MARKER = "--fableforge-app-imports--"
+LINE_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# Modules that should only load when the page using them is opened
+DEFERRED_MODULES = ("google.generativeai", "gradio_client", "PIL", "requests", "numpy")
+
+
+def app_imports(path=APP_FILE):
+    """Top-level module names imported by the app file (imports inside functions are deferred)"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+def measure_once(modules):
+    """Run one fresh interpreter and return {module: (self_us, cumulative_us, depth)} for the app's imports"""
+    code = (
+        "import sys, streamlit\n"
+        f"sys.stderr.write({MARKER!r} + '\\n')\n"
+        + "".join(f"import {module}\n" for module in modules)
+    )
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(APP_FILE),
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "import failed")
+    timings = {}
+    lines = completed.stderr.split(MARKER, 1)[-1].splitlines()
+    for line in lines:
+        match = LINE_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            timings[name] = (int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+    return timings
+
+def measure(modules, runs=5):
+    """Median timings over several runs; the first run also warms the bytecode cache"""
+    samples = [measure_once(modules) for _ in range(runs)]
+    report = {}
+    for name in samples[-1]:
+        values = [sample[name] for sample in samples if name in sample]
+        report[name] = {
+            "self_ms": statistics.median(value[0] for value in values) / 1000,
+            "cumulative_ms": statistics.median(value[1] for value in values) / 1000,
+            "depth": values[0][2],
+        }
+    total = statistics.median(
+        sum(cumulative for _, cumulative, depth in sample.values() if depth == 0) for sample in samples
+    ) / 1000
+    return {"timestamp": time.time(), "python": sys.version.split()[0], "runs": runs,
+            "app_modules": modules, "total_ms": total, "modules": report}
+
+
+def print_report(report, top=15, baseline=None):
+    modules = report["modules"]
+    previous = baseline["modules"] if baseline else {}
+    print(f"\n🚀 App imports: {report['total_ms']:.1f} ms (median of {report['runs']} runs, "
+          f"{len(modules)} modules beyond streamlit)")
+    if baseline:
+        change = report["total_ms"] - baseline["total_ms"]
+        print(f"   Baseline {baseline['total_ms']:.1f} ms ({change:+.1f} ms)")
+
+    print(f"\n{'top-level import':<32} {'cumulative':>11}" + (f" {'change':>9}" if baseline else ""))
+    for name, row in sorted(modules.items(), key=lambda item: -item[1]["cumulative_ms"]):
+        if row["depth"] == 0:
+            line = f"{name:<32} {row['cumulative_ms']:>9.1f}ms"
+            if baseline:
+                before = previous.get(name, {}).get("cumulative_ms", 0.0)
+                line += f" {row['cumulative_ms'] - before:>+7.1f}ms"
+            print(line)
+
+    print(f"\n{'slowest modules (self time)':<32} {'self':>11}")
+    for name, row in sorted(modules.items(), key=lambda item: -item[1]["self_ms"])[:top]:
+        print(f"{name:<32} {row['self_ms']:>9.1f}ms")
+
+    if baseline:
+        added = sorted(set(modules) - set(previous), key=lambda name: -modules[name]["cumulative_ms"])
+        if added:
+            print(f"\n🆕 Newly imported at startup: {', '.join(added[:top])}")
+
+def deferred_violations(report):
+    """Deferred modules (or their submodules) that were imported at startup anyway"""
+    return sorted(
+        name for name in report["modules"]
+        if any(name == module or name.startswith(module + ".") for module in DEFERRED_MODULES)
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Report main.py's startup import time")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure (median is reported)")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    parser.add_argument("--output", help="Save the JSON report to this file")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    parser.add_argument("--budget", type=float, help="Exit non-zero if app imports take longer than this many ms")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    modules = app_imports()
+    print(f"⏱️ Measuring startup imports of {os.path.basename(APP_FILE)}: {', '.join(modules)}")
+    try:
+        report = measure(modules, max(args.runs, 1))
+    except RuntimeError as e:
+        print(f"❌ Could not import the app modules: {e}")
+        return 1
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, args.top, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report saved to {args.output}")
+
+    status = 0
+    violations = deferred_violations(report)
+    if violations:
+        print(f"\n⚠️ Imported at startup but meant to load lazily: {', '.join(violations[:args.top])}")
+        status = 1
+    if args.budget is not None and report["total_ms"] > args.budget:
+        print(f"\n❌ App imports took {report['total_ms']:.1f} ms, over the {args.budget:.0f} ms budget")
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
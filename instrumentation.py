@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import bisect
+import threading
+import functools
+from contextlib import ContextDecorator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = os.getenv("FABLEFORGE_METRICS_PORT")
+METRICS_JSONL = os.getenv("FABLEFORGE_METRICS_JSONL")
+METRICS_INTERVAL = float(os.getenv("FABLEFORGE_METRICS_INTERVAL", "60"))
+
+# Prometheus-style latency buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with sum and count"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        """Estimate a quantile as the upper bound of the bucket that contains it"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Process-wide store of latency histograms and counters, keyed by name and labels"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        if not amount:
+            return
+        with self._lock:
+            key = self._key(name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """Plain-dict view of every metric, for JSONL export and the admin page"""
+        with self._lock:
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.total,
+                    "p50": histogram.quantile(0.50),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+        return {"timestamp": time.time(), "histograms": histograms, "counters": counters}
+
+    def prometheus_text(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        def render_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = f"fableforge_{name}_seconds"
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{render_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{metric}_bucket{render_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{metric}_sum{render_labels(labels)} {histogram.total}")
+                lines.append(f"{metric}_count{render_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"fableforge_{name}_total{render_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+metrics = MetricsRegistry()
+
+
+class timed(ContextDecorator):
+    """Record the wall time of a block or function in a latency histogram.
+
+    Usable as `with timed("tts_request"):` or as `@timed("list_models")`.
+    Exceptions are counted in `<name>_errors` and re-raised.
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.elapsed = time.perf_counter() - self.start
+        metrics.observe(self.name, self.elapsed, **self.labels)
+        if exc_type is not None:
+            metrics.increment(f"{self.name}_errors", **self.labels)
+        return False
+
+
+def payload_size(value):
+    """Approximate bytes of a prompt/contents value (text, bytes, inline blobs, lists)"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return payload_size(value.get("data"))
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(item) for item in value)
+    return 0
+
+def record_io(name, sent=0, received=0, usage=None, **labels):
+    """Count request/response bytes and token usage for an endpoint"""
+    metrics.increment(f"{name}_bytes_out", sent, **labels)
+    metrics.increment(f"{name}_bytes_in", received, **labels)
+    for key, value in (usage or {}).items():
+        metrics.increment(f"{name}_{key}", value, **labels)
+
+def instrument_result(name):
+    """Decorator for functions returning a GenerationResult-like object.
+
+    Times the call and records bytes sent, bytes received, token usage,
+    cache hits and failures by kind.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                result = fn(*args, **kwargs)
+            # The prompt (and image, for vision calls) are the first two arguments
+            sent = payload_size(args[:2]) + payload_size(kwargs.get("image"))
+            text = getattr(result, "text", "") or ""
+            record_io(name, sent, payload_size(text), getattr(result, "usage", None))
+            if getattr(result, "cached", False):
+                metrics.increment(f"{name}_cache_hits")
+            if getattr(result, "error_kind", None):
+                metrics.increment(f"{name}_failures", kind=result.error_kind)
+            return result
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _write_jsonl(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(metrics.snapshot()) + "\n")
+        except OSError as e:
+            print(f"Warning: could not write metrics to {path}. Error: {e}")
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+def start_exporters(port=METRICS_PORT, jsonl_path=METRICS_JSONL, interval=METRICS_INTERVAL):
+    """Start the local Prometheus endpoint and/or JSONL writer once per process"""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if port:
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", int(port)), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        except OSError as e:
+            print(f"Warning: could not start metrics endpoint on port {port}. Error: {e}")
+    if jsonl_path:
+        threading.Thread(
+            target=_write_jsonl, args=(jsonl_path, interval), name="metrics-jsonl", daemon=True
+        ).start()
@@ -1,20 +1,42 @@
 import os
 import time
+import uuid
+import hashlib
+import functools
 from dotenv import load_dotenv
-from PIL import Image
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 from streamlit_option_menu import option_menu
-import requests
 from gemini_utility import (
-    load_gemini_pro_model,
+    load_model_for_task,
     gemini_pro_response,
     gemini_pro_vision_response,
     embeddings_model_response,
     gemini_stream_response,
     get_available_models,
-    check_api_key
+    check_api_key,
+    get_model_registry,
+    semantic_cache_stats,
+    summarize_transcript
 )
-from gradio_client import Client
+from generation_profiles import AUTO_MODEL
+from model_router import get_model_router
+from chat_utility import (
+    ChatContextManager,
+    ChatUsage,
+    HistoryView,
+    ReplyBlockedError,
+    history_messages,
+    send_chat_message,
+    stream_chat_message
+)
+from instrumentation import metrics, start_exporters
+from prompt_templates import render as render_prompt
+from request_log import log_request
+from story_variants import CANCELLED, DONE, FAILED, MAX_VARIANTS, PENDING, VariantRun
+
+# Wall time of this script run, recorded per page at the bottom
+rerun_started = time.perf_counter()
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,6 +44,17 @@ load_dotenv()
 # Accessing the API keys from environment variables
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
+# Show the metrics page in the navigation menu
+ADMIN_MODE = bool(os.getenv("FABLEFORGE_ADMIN"))
+# How often the video job list refreshes while videos are rendering (seconds)
+VIDEO_POLL_SECONDS = 2
+# How often side-by-side story variants refresh while they stream (seconds)
+VARIANT_POLL_SECONDS = 0.5
+# How often novella chapters refresh while they are written (seconds)
+NOVELLA_POLL_SECONDS = 1
+
+# Prometheus endpoint / JSONL writer, if configured
+start_exporters()
 
 working_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -92,28 +125,64 @@ if not GEMINI_API_KEY:
 # Initialize session state
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
-if "api_status" not in st.session_state:
-    st.session_state.api_status = check_api_key()
+# The health probe is cached process-wide and its first run happens in the
+# background, so it never holds up the first paint (None = still checking)
+st.session_state.api_status = check_api_key(wait=False)
 
 # Main header
 st.markdown('<h1 class="main-header">🧠 FableForge AI - Story Engine</h1>', unsafe_allow_html=True)
 
+def timed_fragment(name, run_every=None):
+    """st.fragment that records the duration of each of its runs as `streamlit_fragment`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe("streamlit_fragment", time.perf_counter() - start, fragment=name)
+        return st.fragment(run, run_every=run_every)
+    return decorator
+
+def rerun_fragment():
+    """Rerun only the calling fragment, or the whole app during a full run (where fragment scope is not allowed)"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
 # Sidebar with enhanced navigation
 with st.sidebar:
     
-    # API Status indicator
-    if st.session_state.api_status:
-        st.success("🟢 API Connected")
-    else:
-        st.error("🔴 API Disconnected")
+    # API Status indicator; polls until the startup probe has finished
+    @timed_fragment("api_status", run_every=1 if st.session_state.api_status is None else None)
+    def show_api_status():
+        api_status = check_api_key(wait=False)
+        if api_status is None:
+            st.info("🟡 Checking API connection...")
+        elif st.session_state.api_status is None:
+            # Probe finished: rerun the whole page so the model list refreshes too
+            st.rerun()
+        elif api_status:
+            st.success("🟢 API Connected")
+        else:
+            st.error("🔴 API Disconnected")
+
+    show_api_status()
         
     st.markdown("---")
     
     # Enhanced navigation menu
+    pages = ['🤖 ChatBot', '📚 Story Generator', '🎬 Comic Video Generator', '🎯 AI Assistant']
+    page_icons = ['chat-dots-fill', 'book-fill', 'play-fill', 'robot']
+    if ADMIN_MODE:
+        pages.append('📈 Metrics')
+        page_icons.append('speedometer2')
     selected = option_menu(
         'Navigation',
-        ['🤖 ChatBot', '📚 Story Generator', '🎬 Comic Video Generator', '🎯 AI Assistant'],
-        icons=['chat-dots-fill', 'book-fill', 'play-fill', 'robot'],
+        pages,
+        icons=page_icons,
         menu_icon='cpu-fill',
         default_index=0,
         styles={
@@ -130,19 +199,73 @@ with st.sidebar:
     )
     
     st.markdown("---")
-    
-    # Model selection
-    available_models = get_available_models()
-    selected_model = st.selectbox(
-        "🎯 Select AI Model",
-        available_models[:5],  # Show first 5 models
-        help="Choose the AI model for content generation"
+
+    # Model and settings widgets rerun only this fragment; pages read their
+    # values from session state when they generate
+    @timed_fragment("sidebar_settings")
+    def show_generation_settings():
+        # Model selection
+        available_models = get_available_models(wait=False)
+        st.selectbox(
+            "🎯 Select AI Model",
+            [AUTO_MODEL] + available_models[:5],  # Show first 5 models
+            key="selected_model",
+            help="Choose the AI model for content generation. Auto picks a smaller, faster model for short tasks."
+        )
+
+        # Settings section
+        with st.expander("⚙️ Settings"):
+            st.slider(
+                "Temperature", 0.0, 1.0, 0.7,
+                key="temperature",
+                help="Controls randomness in responses (used when a specific model is selected)"
+            )
+            st.slider("Max Tokens", 100, 2048, 1000, key="max_tokens", help="Maximum response length")
+            st.checkbox(
+                "♻️ Reuse cached responses",
+                value=True,
+                key="use_cache",
+                help="Serve identical requests from the local cache. Turn off for fresh output."
+            )
+            semantic_stats = semantic_cache_stats()
+            if semantic_stats:
+                st.caption(
+                    f"🧠 Similar-prompt cache: {semantic_stats['hit_rate']:.0%} hit rate, "
+                    f"{semantic_stats['time_saved']:.1f}s saved"
+                )
+
+        # Model router decisions and rolling latency per model
+        with st.expander("📈 Model Routing"):
+            router_metrics = get_model_router().metrics()
+            if router_metrics["models"]:
+                st.dataframe(router_metrics["models"], hide_index=True)
+                st.json({"decisions": router_metrics["decisions"], "events": router_metrics["events"]})
+            else:
+                st.caption("No generations yet.")
+
+    show_generation_settings()
+
+def generation_overrides():
+    """Sidebar overrides passed to every generation call; in Auto mode each task keeps
+    its own model and temperature and the token slider only tightens its output cap"""
+    if st.session_state.selected_model == AUTO_MODEL:
+        return {"max_tokens": st.session_state.max_tokens}
+    return {
+        "model": st.session_state.selected_model,
+        "temperature": st.session_state.temperature,
+        "max_tokens": st.session_state.max_tokens
+    }
+
+# Identifies this browser session in the request log
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:12]
+
+def record_request(template, inputs, **details):
+    """Log a generation request (when FABLEFORGE_REQUEST_LOG is set) for replay.py"""
+    log_request(
+        selected, template, inputs, st.session_state.session_id,
+        overrides=generation_overrides(), use_cache=st.session_state.use_cache, **details
     )
-    
-    # Settings section
-    with st.expander("⚙️ Settings"):
-        temperature = st.slider("Temperature", 0.0, 1.0, 0.7, help="Controls randomness in responses")
-        max_tokens = st.slider("Max Tokens", 100, 2048, 1000, help="Maximum response length")
 
 # Function to translate roles between Gemini-Pro and Streamlit terminology
 def translate_role_for_streamlit(user_role):
@@ -154,32 +277,193 @@ def translate_role_for_streamlit(user_role):
 # Enhanced text-to-speech function
 def text2speech(text):
     """Convert text to speech using Hugging Face API"""
+    from tts_utility import TTSError, get_tts_client
+
     if not HUGGINGFACE_API_KEY:
         st.warning("⚠️ Hugging Face token not found. Audio generation disabled.")
         return None
-        
-    API_URL = "https://api-inference.huggingface.co/models/facebook/mms-tts-eng"
-    headers = {"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"}
-    payload = {"inputs": text}
-    
+
     try:
-        response = requests.post(API_URL, headers=headers, json=payload)
-        if response.status_code == 200:
-            return response.content
-        else:
-            st.error(f"❌ Audio generation failed. Status: {response.status_code}")
-            return None
+        return get_tts_client(HUGGINGFACE_API_KEY).synthesize(text)
+    except TTSError as e:
+        st.error(f"❌ {str(e)}")
+        return None
     except Exception as e:
         st.error(f"❌ Audio generation error: {str(e)}")
         return None
 
+def show_generation_error(result):
+    """Show a failed GenerationResult without treating it as content"""
+    st.error(f"❌ {result.error}")
+    if result.transient:
+        st.info("💡 This looks temporary (rate limit or timeout). Please try again in a moment.")
+
+def narrate_streaming_story(prompt):
+    """Stream a story and play its audio segments as soon as each sentence is synthesized"""
+    from tts_utility import NarrationPipeline, get_tts_client, join_wav, wav_duration
+
+    st.subheader("📚 Your Generated Story")
+    story_placeholder = st.empty()
+    audio_area = st.container()
+
+    narration = None
+    if HUGGINGFACE_API_KEY:
+        narration = NarrationPipeline(get_tts_client(HUGGINGFACE_API_KEY))
+    else:
+        st.warning("⚠️ Hugging Face token not found. Audio generation disabled.")
+
+    queued = []
+    played = set()
+    playing_until = 0.0
+
+    def play(audio):
+        # Autoplaying players with identical audio would share an element ID
+        nonlocal playing_until
+        while hashlib.sha1(audio).digest() in played:
+            audio = join_wav([audio], lead_silence=0.01)
+        played.add(hashlib.sha1(audio).digest())
+        audio_area.audio(audio, format="audio/wav", autoplay=True)
+        playing_until = time.monotonic() + wav_duration(audio)
+
+    def show_segments(segments):
+        for audio_bytes, error in segments:
+            if error is not None:
+                audio_area.warning(f"⚠️ Skipped an audio segment: {error}")
+            elif audio_bytes:
+                queued.append(audio_bytes)
+            # Segments that arrive while a player is still going wait for the next one
+            if queued and time.monotonic() >= playing_until:
+                play(join_wav(queued))
+                queued.clear()
+
+    stream = gemini_stream_response(prompt, task="text_story", overrides=generation_overrides())
+    if not stream.ok:
+        show_generation_error(stream.result)
+        return
+
+    story = ""
+    for text in stream:
+        story += text
+        story_placeholder.markdown(story + "▌")
+        if narration is not None:
+            narration.feed(text)
+            show_segments(narration.ready_segments())
+    story_placeholder.markdown(story)
+    if not stream.ok:
+        show_generation_error(stream.result)
+
+    if narration is not None:
+        narration.finish()
+        with st.spinner("🎤 Finishing narration..."):
+            show_segments(narration.remaining_segments())
+        if queued:
+            # One last player for the rest; its leading silence lets the current one finish first
+            play(join_wav(queued, lead_silence=max(0.0, playing_until - time.monotonic())))
+        if narration.time_to_first_audio is not None:
+            st.caption(f"⏱️ First audio after {narration.time_to_first_audio:.1f}s")
+
+def variant_count_input(key):
+    """How many versions to generate side by side (1 = a single story)"""
+    return st.select_slider(
+        "🔀 Variants",
+        options=list(range(1, MAX_VARIANTS + 1)),
+        key=f"{key}_variant_count",
+        help="Write several versions at once, each at a slightly different temperature, and keep your favourite"
+    )
+
+def start_variants(key, rendered, count, image=None):
+    """Start streaming `count` variants of a prompt in the background for this tab"""
+    st.session_state[f"{key}_variants"] = VariantRun(
+        rendered.prompt, rendered.task, generation_overrides(), count, image
+    ).start()
+
+def discard_variants(key):
+    """Stop and forget this tab's previous variants"""
+    run = st.session_state.pop(f"{key}_variants", None)
+    if run is not None:
+        run.cancel()
+
+def show_variant(variant):
+    if variant.status == PENDING:
+        status = "⏳ Waiting"
+    elif variant.status == DONE:
+        status = f"✅ Done in {variant.latency:.1f}s"
+    elif variant.status == CANCELLED:
+        status = "⛔ Stopped"
+    elif variant.status == FAILED:
+        status = "❌ Failed"
+    else:
+        status = "✍️ Writing..."
+    st.caption(f"🌡️ Temperature {variant.temperature:.2f} · {status}")
+    if variant.status == FAILED:
+        st.error(f"❌ {variant.error}")
+    elif variant.text:
+        st.markdown(variant.text if variant.finished else variant.text + "▌")
+
+def show_story_variants(key, title):
+    """This tab's variants side by side until one is picked, then the picked one"""
+    run = st.session_state.get(f"{key}_variants")
+    if run is None:
+        return
+    polling = not run.finished
+
+    # Streams into the columns without rerunning the tab
+    @timed_fragment(f"{key}_variants", run_every=VARIANT_POLL_SECONDS if polling else None)
+    def show_variants():
+        if polling and run.finished:
+            # Everything has arrived: rerun once so this section stops polling
+            st.rerun()
+        chosen = run.chosen
+        if chosen is None:
+            st.subheader(f"🔀 Pick your favourite of {len(run.variants)} versions")
+            for variant, column in zip(run.variants, st.columns(len(run.variants))):
+                with column:
+                    show_variant(variant)
+                    if st.button("✅ Pick this one", key=f"{key}_pick_{variant.index}", disabled=not variant.text):
+                        # The other versions stop streaming straight away
+                        run.pick(variant.index)
+                        rerun_fragment()
+            return
+
+        st.subheader(title)
+        show_variant(chosen)
+        if chosen.status != DONE:
+            return
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("🔊 Generate Audio", key=f"{key}_variant_audio"):
+                with st.spinner("🎵 Generating audio..."):
+                    audio_bytes = text2speech(chosen.text)
+                    if audio_bytes:
+                        st.audio(audio_bytes, format="audio/wav")
+        with col2:
+            st.download_button(
+                "📥 Download Story",
+                chosen.text,
+                file_name=f"story_{int(time.time())}.txt",
+                mime="text/plain",
+                key=f"{key}_variant_download"
+            )
+
+    show_variants()
+
 # Enhanced ChatBot page
-if selected == '🤖 ChatBot':
-    model = load_gemini_pro_model()
+@timed_fragment("chatbot")
+def chatbot_page():
+    model, _ = load_model_for_task("chat", generation_overrides())
 
     # Initialize chat session in Streamlit if not already present
     if "chat_session" not in st.session_state:  
         st.session_state.chat_session = model.start_chat(history=[])
+    elif st.session_state.chat_session.model is not model:
+        # Model or settings changed in the sidebar: keep the conversation
+        st.session_state.chat_session = model.start_chat(history=st.session_state.chat_session.history)
+    if "chat_usage" not in st.session_state:
+        st.session_state.chat_usage = ChatUsage()
+    if "chat_context" not in st.session_state:
+        st.session_state.chat_context = ChatContextManager(summarize_transcript)
+    if "chat_view" not in st.session_state:
+        st.session_state.chat_view = HistoryView()
 
     # Display the chatbot's title on the page
     st.title("🤖 Enhanced AI ChatBot")
@@ -189,12 +473,18 @@ if selected == '🤖 ChatBot':
     with col1:
         if st.button("🔄 Clear Chat"):
             st.session_state.chat_session = model.start_chat(history=[])
-            st.rerun()
+            st.session_state.chat_usage = ChatUsage()
+            st.session_state.chat_context = ChatContextManager(summarize_transcript)
+            st.session_state.chat_view.reset()
+            rerun_fragment()
     with col2:
         if st.button("💾 Save Chat"):
             st.download_button(
                 "Download Chat",
-                data=str(st.session_state.chat_session.history),
+                data="\n\n".join(
+                    f"{message.role}: {message.text}"
+                    for message in history_messages(st.session_state.chat_session)
+                ),
                 file_name="chat_history.txt",
                 mime="text/plain"
             )
@@ -202,16 +492,29 @@ if selected == '🤖 ChatBot':
         stream_mode = st.toggle("🌊 Stream Mode", help="Enable streaming responses")
     with col4:
         if st.button("📊 Chat Stats"):
-            st.info(f"Messages: {len(st.session_state.chat_session.history)}")
+            registry_stats = get_model_registry().stats()
+            chat_usage = st.session_state.chat_usage
+            st.info(
+                f"Messages: {len(st.session_state.chat_session.history)} | "
+                f"Tokens: {chat_usage.prompt_tokens} in / {chat_usage.response_tokens} out | "
+                f"Saved by compaction: {st.session_state.chat_context.total_saved} | "
+                f"Model cache: {registry_stats['hits']} hits / {registry_stats['misses']} misses"
+            )
 
     # Chat container with enhanced styling
     chat_container = st.container(height=400)
     
     with chat_container:
-        # Display the chat history
-        for message in st.session_state.chat_session.history:
+        # Display only the latest page(s) of the chat history
+        hidden_count, visible_messages = st.session_state.chat_view.visible(
+            st.session_state.chat_session.history
+        )
+        if hidden_count and st.button(f"⬆️ Load older messages ({hidden_count} hidden)"):
+            st.session_state.chat_view.load_older()
+            rerun_fragment()
+        for message in visible_messages:
             with st.chat_message(translate_role_for_streamlit(message.role)):
-                st.markdown(message.parts[0].text)
+                st.markdown(message.text)
 
     # Input field for user's message with enhanced features
     col1, col2 = st.columns([4, 1])
@@ -224,6 +527,16 @@ if selected == '🤖 ChatBot':
             st.info("Voice input feature - Coming soon!")
     
     if user_prompt:
+        record_request("chat", {"message": user_prompt}, stream=stream_mode)
+
+        # Keep the resent history under the token budget before this turn
+        try:
+            compaction = st.session_state.chat_context.compact(st.session_state.chat_session)
+            if compaction.compacted:
+                st.toast(f"🗜️ Summarized older messages: ~{compaction.tokens_before - compaction.tokens_after} fewer tokens per turn")
+        except Exception as e:
+            st.warning(f"⚠️ Could not compact chat history: {str(e)}")
+
         # Add user's message to chat and display it
         with chat_container:
             with st.chat_message("user"):
@@ -238,190 +551,386 @@ if selected == '🤖 ChatBot':
                     response_text = ""
                     
                     try:
-                        response = gemini_stream_response(user_prompt)
-                        for chunk in response:
-                            if hasattr(chunk, 'text'):
-                                response_text += chunk.text
-                                response_placeholder.markdown(response_text + "▌")
+                        # The chat session records both turns once the stream is consumed
+                        for text in stream_chat_message(
+                            st.session_state.chat_session, user_prompt, st.session_state.chat_usage
+                        ):
+                            response_text += text
+                            response_placeholder.markdown(response_text + "▌")
                         response_placeholder.markdown(response_text)
-                        
-                        # Update session manually for streaming
-                        st.session_state.chat_session.history.append(
-                            type('Message', (), {'role': 'user', 'parts': [type('Part', (), {'text': user_prompt})]})()
-                        )
-                        st.session_state.chat_session.history.append(
-                            type('Message', (), {'role': 'model', 'parts': [type('Part', (), {'text': response_text})]})()
-                        )
+                    except ReplyBlockedError as e:
+                        # The partial reply was dropped from the chat, so hide it here too
+                        response_placeholder.empty()
+                        st.warning(f"🚫 {str(e)}")
                     except Exception as e:
                         st.error(f"❌ Error: {str(e)}")
                 else:
                     # Regular response
                     try:
-                        gemini_response = st.session_state.chat_session.send_message(user_prompt)
-                        st.markdown(gemini_response.text)
+                        response_text = send_chat_message(
+                            st.session_state.chat_session, user_prompt, st.session_state.chat_usage
+                        )
+                        st.markdown(response_text)
                     except Exception as e:
                         st.error(f"❌ Error: {str(e)}")
 
-# Enhanced Story Generator page
-elif selected == '📚 Story Generator':
-    st.title("📚 AI Story Generator")
-    
-    # Enhanced layout with tabs
-    tab1, tab2, tab3 = st.tabs(["🖼️ Image + Text Story", "📝 Text-Only Story", "🎨 Creative Writing"])
-    
-    with tab1:
-        st.header("📷 Image-Based Story Generation")
-        
-        col1, col2 = st.columns([1, 1])
-        
-        with col1:
-            st.subheader("📤 Upload Your Image")
-            uploaded_image = st.file_uploader(
-                "Choose an image...", 
-                type=["jpg", "jpeg", "png", "webp"],
-                help="Upload an image to generate a story based on it"
-            )
-            
-            if uploaded_image:
-                image = Image.open(uploaded_image)
-                st.image(image, caption="Uploaded Image", use_container_width=True)
-        
-        with col2:
-            st.subheader("✍️ Story Details")
-            user_text = st.text_area(
-                "Provide story theme or details...",
-                placeholder="E.g., A magical adventure, mystery thriller, romantic comedy...",
-                height=100
-            )
-            
-            # Story configuration
-            story_length = st.selectbox(
-                "📏 Story Length",
-                ["Short (5-10 lines)", "Medium (10-20 lines)", "Long (20-30 lines)"]
-            )
-            
-            story_genre = st.selectbox(
-                "🎭 Genre",
-                ["Adventure", "Mystery", "Romance", "Horror", "Comedy", "Sci-Fi", "Fantasy"]
+# Enhanced Story Generator page; each tab reruns on its own
+@timed_fragment("image_story")
+def image_story_tab():
+    # Page-specific modules are imported on first visit to keep cold start fast
+    from image_utility import prepare_upload
+
+    st.header("📷 Image-Based Story Generation")
+
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        st.subheader("📤 Upload Your Image")
+        uploaded_image = st.file_uploader(
+            "Choose an image...", 
+            type=["jpg", "jpeg", "png", "webp"],
+            help="Upload an image to generate a story based on it"
+        )
+
+        if uploaded_image:
+            # Downsized and re-encoded once per upload, reused across reruns
+            prepared_image = prepare_upload(uploaded_image.getvalue())
+            image = prepared_image.image
+            st.image(image, caption="Uploaded Image", use_container_width=True)
+            st.caption(
+                f"📦 {prepared_image.original_size / 1024:.0f} KB → "
+                f"{len(prepared_image.data) / 1024:.0f} KB sent to the model"
             )
-            
-            include_moral = st.checkbox("✨ Include Moral Lesson", value=True)
-            
-            generate_audio = st.checkbox("🔊 Generate Audio", value=True)
-        
-        if st.button("🎯 Generate Image Story", type="primary"):
-            if uploaded_image is not None and user_text.strip():
+
+    with col2:
+        st.subheader("✍️ Story Details")
+        user_text = st.text_area(
+            "Provide story theme or details...",
+            placeholder="E.g., A magical adventure, mystery thriller, romantic comedy...",
+            height=100
+        )
+
+        # Story configuration
+        story_length = st.selectbox(
+            "📏 Story Length",
+            ["Short (5-10 lines)", "Medium (10-20 lines)", "Long (20-30 lines)"]
+        )
+
+        story_genre = st.selectbox(
+            "🎭 Genre",
+            ["Adventure", "Mystery", "Romance", "Horror", "Comedy", "Sci-Fi", "Fantasy"]
+        )
+
+        include_moral = st.checkbox("✨ Include Moral Lesson", value=True)
+
+        generate_audio = st.checkbox("🔊 Generate Audio", value=True)
+
+        variant_count = variant_count_input("image_story")
+
+    if st.button("🎯 Generate Image Story", type="primary"):
+        if uploaded_image is not None and user_text.strip():
+            story_inputs = {
+                "theme": user_text,
+                "length": story_length,
+                "genre": story_genre,
+                "include_moral": include_moral
+            }
+            rendered = render_prompt("image_story", story_inputs)
+            record_request("image_story", story_inputs, image_size=list(image.size), variants=variant_count)
+            discard_variants("image_story")
+
+            if variant_count > 1:
+                start_variants("image_story", rendered, variant_count, prepared_image.blob)
+            else:
                 with st.spinner("🤖 AI is crafting your story..."):
-                    # Enhanced prompt
-                    length_map = {
-                        "Short (5-10 lines)": "5-10 lines",
-                        "Medium (10-20 lines)": "10-20 lines", 
-                        "Long (20-30 lines)": "20-30 lines"
-                    }
-                    
-                    prompt = f"""
-                    Generate a {story_genre.lower()} story based on this image with the following requirements:
-                    - Theme/Details: {user_text}
-                    - Length: {length_map[story_length]}
-                    - Genre: {story_genre}
-                    - Include moral lesson: {include_moral}
-                    
-                    Make the story engaging, creative, and well-structured.
-                    """
-                    
-                    story = gemini_pro_vision_response(prompt, image)
-                    
-                    # Display results
-                    col1, col2 = st.columns([1, 1])
-                    
-                    with col1:
-                        st.image(image, caption="Story Inspiration", use_container_width=True)
-                    
-                    with col2:
-                        st.subheader("📖 Generated Story")
-                        st.write(story)
-                        
-                        # Audio generation
-                        if generate_audio and story:
-                            with st.spinner("🎵 Generating audio..."):
-                                audio_bytes = text2speech(story)
+                    story_result = gemini_pro_vision_response(
+                        rendered.prompt, prepared_image.blob, use_cache=st.session_state.use_cache,
+                        task=rendered.task, overrides=generation_overrides()
+                    )
+
+                    if not story_result.ok:
+                        show_generation_error(story_result)
+                    else:
+                        story = story_result.text
+
+                        # Display results
+                        col1, col2 = st.columns([1, 1])
+
+                        with col1:
+                            st.image(image, caption="Story Inspiration", use_container_width=True)
+
+                        with col2:
+                            st.subheader("📖 Generated Story")
+                            st.write(story)
+
+                            # Audio generation
+                            if generate_audio and story:
+                                with st.spinner("🎵 Generating audio..."):
+                                    audio_bytes = text2speech(story)
+                                    if audio_bytes:
+                                        st.audio(audio_bytes, format="audio/wav")
+
+                            # Download options
+                            st.download_button(
+                                "📥 Download Story",
+                                story,
+                                file_name=f"story_{int(time.time())}.txt",
+                                mime="text/plain"
+                            )
+
+    show_story_variants("image_story", "📖 Generated Story")
+
+@timed_fragment("text_story")
+def text_story_tab():
+    st.header("📝 Text-Only Story Generation")
+
+    col1, col2 = st.columns([2, 1])
+
+    with col1:
+        user_text = st.text_area(
+            "📝 Describe your story idea:",
+            placeholder="Describe characters, setting, plot, or any story elements...",
+            height=150
+        )
+
+    with col2:
+        st.subheader("⚙️ Story Settings")
+        story_length = st.radio("Length", ["Short", "Medium", "Long"])
+        story_tone = st.selectbox("Tone", ["Cheerful", "Dark", "Mysterious", "Humorous", "Dramatic"])
+        target_audience = st.selectbox("Audience", ["Children", "Teenagers", "Adults", "All Ages"])
+        variant_count = variant_count_input("text_story")
+        live_narration = st.checkbox(
+            "🎧 Live Narration",
+            disabled=variant_count > 1,
+            help="Start narrating the first sentences while the rest of the story is still being written"
+        ) and variant_count == 1
+
+    if st.button("✨ Generate Text Story", type="primary"):
+        if user_text.strip():
+            story_inputs = {
+                "idea": user_text,
+                "length": story_length,
+                "tone": story_tone,
+                "audience": target_audience
+            }
+            rendered = render_prompt("text_story", story_inputs)
+            record_request("text_story", story_inputs, stream=live_narration, variants=variant_count)
+            discard_variants("text_story")
+
+            if variant_count > 1:
+                start_variants("text_story", rendered, variant_count)
+            elif live_narration:
+                narrate_streaming_story(rendered.prompt)
+            else:
+                with st.spinner("🎭 Creating your story..."):
+                    story_result = gemini_pro_response(
+                        rendered.prompt,
+                        use_cache=st.session_state.use_cache,
+                        semantic_scope=rendered.semantic_scope,
+                        semantic_text=rendered.semantic_text,
+                        task=rendered.task,
+                        overrides=generation_overrides()
+                    )
+
+                    if not story_result.ok:
+                        show_generation_error(story_result)
+                    else:
+                        st.subheader("📚 Your Generated Story")
+                        st.write(story_result.text)
+
+                        # Audio option
+                        if st.checkbox("🎵 Generate Audio Version"):
+                            with st.spinner("🎤 Creating audio..."):
+                                audio_bytes = text2speech(story_result.text)
                                 if audio_bytes:
                                     st.audio(audio_bytes, format="audio/wav")
-                        
-                        # Download options
-                        st.download_button(
-                            "📥 Download Story",
-                            story,
-                            file_name=f"story_{int(time.time())}.txt",
-                            mime="text/plain"
-                        )
-    
-    with tab2:
-        st.header("📝 Text-Only Story Generation")
-        
-        col1, col2 = st.columns([2, 1])
-        
+
+    show_story_variants("text_story", "📚 Your Generated Story")
+
+@timed_fragment("creative_writing")
+def creative_writing_tab():
+    st.header("🎨 Creative Writing Assistant")
+
+    writing_type = st.selectbox(
+        "✍️ What would you like to write?",
+        ["Poem", "Song Lyrics", "Short Story", "Character Description", "World Building", "Dialogue"]
+    )
+
+    if writing_type == "Poem":
+        col1, col2 = st.columns(2)
         with col1:
-            user_text = st.text_area(
-                "📝 Describe your story idea:",
-                placeholder="Describe characters, setting, plot, or any story elements...",
-                height=150
-            )
-        
+            poem_style = st.selectbox("Style", ["Free Verse", "Haiku", "Sonnet", "Limerick"])
+            theme = st.text_input("Theme", placeholder="Love, Nature, Adventure...")
         with col2:
-            st.subheader("⚙️ Story Settings")
-            story_length = st.radio("Length", ["Short", "Medium", "Long"])
-            story_tone = st.selectbox("Tone", ["Cheerful", "Dark", "Mysterious", "Humorous", "Dramatic"])
-            target_audience = st.selectbox("Audience", ["Children", "Teenagers", "Adults", "All Ages"])
-            
-        if st.button("✨ Generate Text Story", type="primary"):
-            if user_text.strip():
-                with st.spinner("🎭 Creating your story..."):
-                    prompt = f"""
-                    Create a {story_length.lower()} {story_tone.lower()} story suitable for {target_audience.lower()} 
-                    based on: {user_text}
-                    
-                    Make it engaging and include a meaningful conclusion.
-                    """
-                    
-                    story = gemini_pro_response(prompt)
-                    
-                    st.subheader("📚 Your Generated Story")
-                    st.write(story)
-                    
-                    # Audio option
-                    if st.checkbox("🎵 Generate Audio Version"):
-                        with st.spinner("🎤 Creating audio..."):
-                            audio_bytes = text2speech(story)
-                            if audio_bytes:
-                                st.audio(audio_bytes, format="audio/wav")
+            mood = st.selectbox("Mood", ["Happy", "Sad", "Peaceful", "Energetic"])
+            length = st.selectbox("Length", ["Short", "Medium", "Long"])
+        variant_count = variant_count_input("poem")
+
+        if st.button(f"🎭 Generate {poem_style} Poem"):
+            poem_inputs = {"style": poem_style, "theme": theme, "mood": mood, "length": length}
+            rendered = render_prompt("poem", poem_inputs)
+            record_request("poem", poem_inputs, variants=variant_count)
+            discard_variants("poem")
+            if variant_count > 1:
+                start_variants("poem", rendered, variant_count)
+            else:
+                result = gemini_pro_response(
+                    rendered.prompt,
+                    use_cache=st.session_state.use_cache,
+                    semantic_scope=rendered.semantic_scope,
+                    semantic_text=rendered.semantic_text,
+                    task=rendered.task,
+                    overrides=generation_overrides()
+                )
+                if result.ok:
+                    st.write(result.text)
+                else:
+                    show_generation_error(result)
+
+        show_story_variants("poem", f"🎭 Your {poem_style} Poem")
+
+    # Add similar sections for other writing types...
+
+def show_chapter(chapter):
+    from novella import CANCELLED, DONE, FAILED, PENDING
+
+    if chapter.status == PENDING:
+        status = "⏳ Waiting"
+    elif chapter.status == DONE:
+        status = f"✅ {len(chapter.text.split())} words in {chapter.latency:.0f}s"
+    elif chapter.status == CANCELLED:
+        status = "⛔ Stopped"
+    elif chapter.status == FAILED:
+        status = "❌ Failed"
+    else:
+        status = "✍️ Writing..."
+    st.markdown(f"### Chapter {chapter.number}: {chapter.title}")
+    st.caption(status)
+    if chapter.status == FAILED:
+        st.error(f"❌ {chapter.error}")
+    elif chapter.text:
+        st.markdown(chapter.text if chapter.finished else chapter.text + "▌")
+    else:
+        st.caption(f"📝 {chapter.synopsis}")
+
+def show_novella():
+    """The current novella's chapters, streamed in as they are written"""
+    from novella import DONE
+
+    novella = st.session_state.get("novella")
+    if novella is None:
+        return
+    polling = not novella.finished
+
+    @timed_fragment("novella_chapters", run_every=NOVELLA_POLL_SECONDS if polling else None)
+    def show_chapters():
+        if polling and novella.finished:
+            # Every chapter is in: rerun once so this section stops polling
+            st.rerun()
+        written = sum(chapter.status == DONE for chapter in novella.chapters)
+        st.subheader(f"📖 {written} of {len(novella.chapters)} chapters written")
+        st.progress(written / len(novella.chapters))
+        with st.expander("🗺️ Outline" + (" (from cache)" if novella.outline_result.cached else "")):
+            for chapter in novella.chapters:
+                st.markdown(f"**{chapter.number}. {chapter.title}**: {chapter.synopsis}")
+
+        for chapter in novella.chapters:
+            with st.container(border=True):
+                show_chapter(chapter)
+                if chapter.finished and st.button("🔁 Regenerate", key=f"novella_regenerate_{chapter.number}"):
+                    novella.regenerate(chapter.number)
+                    # Full rerun so this section starts polling again
+                    st.rerun()
+
+        if written:
+            st.download_button(
+                "📥 Download Novella",
+                novella.manuscript(),
+                file_name=f"novella_{novella.id}.md",
+                mime="text/markdown",
+                key="novella_download"
+            )
+        st.caption(f"💾 Chapters are saved to {novella.directory}")
+
+    show_chapters()
+
+@timed_fragment("novella")
+def novella_tab():
+    from novella import MAX_CHAPTERS, MIN_CHAPTERS, Novella
+
+    st.header("📖 Chaptered Novella")
+    st.caption("Plans an outline, then writes the chapters a few at a time. Any chapter can be rewritten on its own.")
+
+    col1, col2 = st.columns([2, 1])
+
+    with col1:
+        idea = st.text_area(
+            "📝 What is your novella about?",
+            placeholder="Describe the premise, main characters and setting...",
+            height=150
+        )
+
+    with col2:
+        st.subheader("⚙️ Novella Settings")
+        chapter_count = st.number_input("Chapters", MIN_CHAPTERS, MAX_CHAPTERS, 5)
+        chapter_words = st.select_slider("Words per chapter", [300, 600, 900, 1200], value=600)
+        tone = st.selectbox(
+            "Tone", ["Cheerful", "Dark", "Mysterious", "Humorous", "Dramatic"], key="novella_tone"
+        )
+        audience = st.selectbox(
+            "Audience", ["Children", "Teenagers", "Adults", "All Ages"], key="novella_audience"
+        )
+
+    if st.button("📖 Write Novella", type="primary"):
+        if idea.strip():
+            novella_inputs = {"idea": idea, "chapters": chapter_count, "tone": tone, "audience": audience}
+            record_request("novella_outline", novella_inputs, words=chapter_words)
+            previous = st.session_state.pop("novella", None)
+            if previous is not None:
+                previous.cancel()
+            novella = Novella(
+                **novella_inputs, words=chapter_words,
+                overrides=generation_overrides(), use_cache=st.session_state.use_cache
+            )
+            with st.spinner("🗺️ Planning the chapters..."):
+                outline = novella.plan()
+            if outline.ok:
+                st.session_state.novella = novella.start()
+            else:
+                show_generation_error(outline)
+
+    show_novella()
+
+def story_generator_page():
+    st.title("📚 AI Story Generator")
+    
+    # Enhanced layout with tabs
+    tab1, tab2, tab3, tab4 = st.tabs(
+        ["🖼️ Image + Text Story", "📝 Text-Only Story", "🎨 Creative Writing", "📖 Novella"]
+    )
     
+    with tab1:
+        image_story_tab()
+    with tab2:
+        text_story_tab()
     with tab3:
-        st.header("🎨 Creative Writing Assistant")
-        
-        writing_type = st.selectbox(
-            "✍️ What would you like to write?",
-            ["Poem", "Song Lyrics", "Short Story", "Character Description", "World Building", "Dialogue"]
-        )
-        
-        if writing_type == "Poem":
-            col1, col2 = st.columns(2)
-            with col1:
-                poem_style = st.selectbox("Style", ["Free Verse", "Haiku", "Sonnet", "Limerick"])
-                theme = st.text_input("Theme", placeholder="Love, Nature, Adventure...")
-            with col2:
-                mood = st.selectbox("Mood", ["Happy", "Sad", "Peaceful", "Energetic"])
-                length = st.selectbox("Length", ["Short", "Medium", "Long"])
-            
-            if st.button(f"🎭 Generate {poem_style} Poem"):
-                prompt = f"Write a {poem_style.lower()} poem about {theme} with a {mood.lower()} mood. Length: {length.lower()}"
-                result = gemini_pro_response(prompt)
-                st.write(result)
-        
-        # Add similar sections for other writing types...
+        creative_writing_tab()
+    with tab4:
+        novella_tab()
+
+def video_owner():
+    """Stable id for this browser's videos, kept in the URL so a reload finds them again"""
+    owner = st.query_params.get("videos")
+    if not owner:
+        owner = st.session_state.session_id
+        st.query_params["videos"] = owner
+    return owner
 
 # Enhanced Comic Video Generator page
-elif selected == '🎬 Comic Video Generator':
+@timed_fragment("comic_video")
+def comic_video_page():
+    from video_jobs import DONE, FAILED, get_video_job_queue
+
     st.title("🎬 AI Comic Video Generator")
     
     col1, col2 = st.columns([2, 1])
@@ -451,10 +960,16 @@ elif selected == '🎬 Comic Video Generator':
         # Preview options
         if st.button("👁️ Preview Story"):
             if user_prompt:
-                enhanced_prompt = f"Enhance this story for comic video: {user_prompt}"
-                enhanced_story = gemini_pro_response(enhanced_prompt)
-                st.write("**Enhanced Story:**")
-                st.write(enhanced_story)
+                rendered = render_prompt("comic_preview", {"script": user_prompt})
+                record_request("comic_preview", {"script": user_prompt})
+                enhanced_story = gemini_pro_response(
+                    rendered.prompt, task=rendered.task, overrides=generation_overrides()
+                )
+                if enhanced_story.ok:
+                    st.write("**Enhanced Story:**")
+                    st.write(enhanced_story.text)
+                else:
+                    show_generation_error(enhanced_story)
         
         # Character settings
         with st.expander("👥 Character Settings"):
@@ -469,35 +984,48 @@ elif selected == '🎬 Comic Video Generator':
 
     if st.button("🎬 Generate Comic Video", type="primary"):
         if user_prompt.strip():
-            with st.spinner("🎭 Creating your comic video... This may take a few minutes."):
-                try:
-                    client = Client("ADOPLE/Video-Generator-AI")
-                    result = client.predict(
-                        user_prompt,
-                        api_name="/generate_video"
-                    )
-                    
-                    if result and 'video' in result:
-                        video_data = result['video']
-                        st.success("🎉 Comic video generated successfully!")
-                        st.video(video_data)
-                        
-                        # Download option
+            get_video_job_queue().submit(user_prompt, video_owner())
+            st.toast("🎬 Video queued! Feel free to explore other pages while it renders.")
+
+    video_queue = get_video_job_queue()
+    owner = video_owner()
+    polling = video_queue.active(owner)
+
+    # Re-runs on its own while videos are rendering, without rerunning the page
+    @timed_fragment("video_jobs", run_every=VIDEO_POLL_SECONDS if polling else None)
+    def show_video_jobs():
+        if polling and not video_queue.active(owner):
+            # Every video has finished: rerun once so this section stops polling
+            st.rerun()
+        jobs = video_queue.jobs(owner, limit=5)
+        if not jobs:
+            return
+        st.subheader("📼 Your Videos")
+        for job in jobs:
+            with st.container(border=True):
+                prompt_preview = job.prompt if len(job.prompt) <= 80 else job.prompt[:80] + "..."
+                st.caption(f"{time.strftime('%b %d, %H:%M', time.localtime(job.created_at))} · {prompt_preview}")
+                if job.status == DONE:
+                    st.video(job.video_path)
+                    with open(job.video_path, "rb") as video_file:
                         st.download_button(
                             "📥 Download Video",
-                            data=video_data,
-                            file_name=f"comic_video_{int(time.time())}.mp4",
-                            mime="video/mp4"
+                            data=video_file,
+                            file_name=f"comic_video_{job.id}.mp4",
+                            mime="video/mp4",
+                            key=f"download_{job.id}"
                         )
-                    else:
-                        st.error("❌ Video generation failed. Please try again.")
-                        
-                except Exception as e:
-                    st.error(f"❌ Error generating video: {str(e)}")
+                elif job.status == FAILED:
+                    st.error(f"❌ Error generating video: {job.error}")
                     st.info("💡 Tip: Try simplifying your story or check your internet connection.")
+                else:
+                    st.info(f"⏳ {job.progress}")
+
+    show_video_jobs()
 
 # New AI Assistant page
-elif selected == '🎯 AI Assistant':
+@timed_fragment("assistant")
+def assistant_page():
     st.title("🎯 AI Assistant Hub")
     
     # Assistant categories
@@ -523,19 +1051,69 @@ elif selected == '🎯 AI Assistant':
         
         if st.button(f"✨ {task}"):
             if user_text:
+                assistant_inputs = {"task": task, "text": user_text}
                 if task == "Change Tone":
-                    prompt = f"Rewrite this text in a {tone.lower()} tone: {user_text}"
+                    assistant_inputs["tone"] = tone
                 elif task == "Translate":
-                    prompt = f"Translate this text to {language}: {user_text}"
+                    assistant_inputs["language"] = language
+                rendered = render_prompt("assistant", assistant_inputs)
+                record_request("assistant", assistant_inputs)
+
+                result = gemini_pro_response(
+                    rendered.prompt, use_cache=st.session_state.use_cache,
+                    task=rendered.task, overrides=generation_overrides()
+                )
+                if result.ok:
+                    st.write("**Result:**")
+                    st.write(result.text)
                 else:
-                    prompt = f"{task} this text: {user_text}"
-                
-                result = gemini_pro_response(prompt)
-                st.write("**Result:**")
-                st.write(result)
+                    show_generation_error(result)
     
     # Add other assistant types...
 
+# Admin-only latency and throughput metrics
+@timed_fragment("metrics")
+def metrics_page():
+    st.title("📈 Metrics")
+    st.caption("Latency percentiles are bucket upper bounds, in seconds.")
+
+    snapshot = metrics.snapshot()
+    if snapshot["histograms"]:
+        st.subheader("⏱️ Latency")
+        st.dataframe(
+            [
+                {"metric": row["name"], **row["labels"], "count": row["count"],
+                 "p50": row["p50"], "p95": row["p95"], "p99": row["p99"]}
+                for row in snapshot["histograms"]
+            ],
+            hide_index=True
+        )
+    if snapshot["counters"]:
+        st.subheader("🔢 Counters")
+        st.dataframe(
+            [{"metric": row["name"], **row["labels"], "value": row["value"]} for row in snapshot["counters"]],
+            hide_index=True
+        )
+    if not snapshot["histograms"] and not snapshot["counters"]:
+        st.info("No metrics recorded yet.")
+
+    if st.button("🗑️ Reset Metrics"):
+        metrics.reset()
+        rerun_fragment()
+
+# Each page is a fragment: its widgets rerun only the page, not the header,
+# sidebar and navigation above it
+if selected == '🤖 ChatBot':
+    chatbot_page()
+elif selected == '📚 Story Generator':
+    story_generator_page()
+elif selected == '🎬 Comic Video Generator':
+    comic_video_page()
+elif selected == '🎯 AI Assistant':
+    assistant_page()
+elif selected == '📈 Metrics':
+    metrics_page()
+
 # Footer
 st.markdown("---")
 st.markdown(
@@ -546,4 +1124,6 @@ st.markdown(
     </div>
     """, 
     unsafe_allow_html=True
-)
\ No newline at end of file
+)
+
+metrics.observe("streamlit_rerun", time.perf_counter() - rerun_started, page=selected)
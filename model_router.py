@@ -0,0 +1,306 @@
+import os
+import time
+import threading
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from stats_utility import percentile
+
+# Relative price per million output tokens; only the ordering matters
+MODEL_COSTS = {
+    "gemini-1.5-flash-8b": 0.15,
+    "gemini-2.0-flash-lite": 0.30,
+    "gemini-1.5-flash": 0.30,
+    "gemini-2.0-flash": 0.40,
+    "gemini-1.5-pro": 5.00,
+}
+# Latency SLO (p95, seconds) each task should meet
+TASK_SLOS = {
+    "default": 10.0,
+    "chat": 5.0,
+    "chat_summary": 8.0,
+    "haiku": 3.0,
+    "poem": 8.0,
+    "grammar_check": 6.0,
+    "summarize": 6.0,
+    "text_story": 20.0,
+    "image_story": 25.0,
+    "novella_outline": 15.0,
+    "novella_chapter": 60.0,
+    "chapter_summary": 8.0,
+}
+ROUTER_FALLBACKS = [
+    model.strip()
+    for model in os.getenv("FABLEFORGE_ROUTER_FALLBACKS", "gemini-2.0-flash,gemini-1.5-flash").split(",")
+    if model.strip()
+]
+ROUTER_WINDOW = 100
+ROUTER_MIN_SAMPLES = 5
+ROUTER_MAX_ERROR_RATE = 0.25
+# Hedged duplicates allowed in flight across all calls; each one is a billed request
+ROUTER_MAX_HEDGES = int(os.getenv("FABLEFORGE_ROUTER_MAX_HEDGES", "4"))
+# How often a call checks whether its attempt has left the quota queue
+_SEND_POLL_SECONDS = 0.1
+
+
+def _short_name(model_name):
+    return model_name.split("/", 1)[-1]
+
+
+class ModelStats:
+    """Rolling latency and error window for one model"""
+
+    def __init__(self, window=ROUTER_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+
+    def record(self, latency, ok):
+        self.requests += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+
+    def percentile(self, fraction):
+        return percentile(sorted(self.latencies), fraction)
+
+    @property
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+
+class RouteAttempt:
+    """One try of a routed call on one model.
+
+    `cancel` is set once another attempt has won; fn should pass it on
+    (e.g. to QuotaScheduler.run) so an attempt that has not been sent yet
+    is dropped instead of becoming a wasted, billed request. fn should also
+    make the request itself through send(), so time spent waiting for quota
+    or backing off is neither counted as model latency nor hedged.
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.cancel = threading.Event()
+        self.sent_at = None
+        self.latency = None
+
+    def send(self, fn):
+        """Call fn(), the API request itself, and time it"""
+        self.sent_at = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            self.latency = time.perf_counter() - self.sent_at
+            self.sent_at = None
+
+
+class ModelRouter:
+    """Route each task to its profile model, with hedging and failover.
+
+    The profile's model goes first unless its measured p95 latency or error
+    rate misses the task's SLO; then the cheapest candidate that meets it
+    takes over. Models without enough samples count as meeting the SLO.
+    A call that runs past the hedge deadline is duplicated on the next
+    candidate (while fewer than `max_hedges` duplicates are in flight) and
+    whichever finishes first wins; the losers are cancelled. Errors fail
+    over to the next candidate immediately.
+    """
+
+    def __init__(self, costs=MODEL_COSTS, slos=TASK_SLOS, fallbacks=ROUTER_FALLBACKS,
+                 max_error_rate=ROUTER_MAX_ERROR_RATE, min_samples=ROUTER_MIN_SAMPLES, workers=16,
+                 max_hedges=ROUTER_MAX_HEDGES):
+        self.costs = costs
+        self.slos = slos
+        self.fallbacks = fallbacks
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self._hedges_in_flight = 0
+        self._stats = {}
+        self._decisions = Counter()
+        self._events = Counter()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="model-router")
+
+    def _model_stats(self, model_name):
+        name = _short_name(model_name)
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = ModelStats()
+        return stats
+
+    def record(self, model_name, latency, ok):
+        with self._lock:
+            self._model_stats(model_name).record(latency, ok)
+
+    def slo(self, task):
+        return self.slos.get(task or "default", self.slos["default"])
+
+    def _meets_slo(self, model_name, slo):
+        stats = self._model_stats(model_name)
+        if len(stats.outcomes) < self.min_samples:
+            return True
+        p95 = stats.percentile(0.95)
+        return stats.error_rate <= self.max_error_rate and (p95 is None or p95 <= slo)
+
+    def route(self, task, model_name, pinned=False):
+        """Return candidate models in the order they should be tried.
+
+        `model_name` is the task profile's model (or the user's explicit pick
+        when `pinned`). It goes first unless, unpinned, its measured stats miss
+        the SLO. The remaining candidates follow cheapest first, with the ones
+        missing the SLO last.
+        """
+        candidates = []
+        for name in [model_name] + self.fallbacks:
+            if _short_name(name) not in map(_short_name, candidates):
+                candidates.append(name)
+        slo = self.slo(task)
+        with self._lock:
+            healthy = [name for name in candidates if self._meets_slo(name, slo)]
+            slow = [name for name in candidates if name not in healthy]
+            healthy.sort(key=lambda name: self.costs.get(_short_name(name), float("inf")))
+            slow.sort(key=lambda name: self._model_stats(name).percentile(0.95) or 0.0)
+            order = healthy + slow
+            if pinned or model_name in healthy:
+                order.remove(model_name)
+                order.insert(0, model_name)
+            self._decisions[(task or "default", _short_name(order[0]))] += 1
+        return order
+
+    def _hedge_after(self, model_name, slo):
+        with self._lock:
+            p95 = self._model_stats(model_name).percentile(0.95)
+        if p95 is None:
+            return slo
+        return min(slo, max(p95 * 1.5, 1.0))
+
+    def _timed(self, fn, attempt):
+        start = time.perf_counter()
+        try:
+            result = fn(attempt.model_name, attempt)
+        except Exception:
+            # Attempts dropped before they were sent say nothing about the model
+            if not attempt.cancel.is_set() or attempt.latency is not None:
+                self.record(attempt.model_name, attempt.latency or time.perf_counter() - start, False)
+            raise
+        self.record(attempt.model_name, attempt.latency or time.perf_counter() - start, True)
+        return result
+
+    def _start_hedge(self):
+        """Reserve a hedge slot; False once `max_hedges` duplicates are in flight"""
+        with self._lock:
+            if self._hedges_in_flight >= self.max_hedges:
+                self._events["hedges_skipped"] += 1
+                return False
+            self._hedges_in_flight += 1
+            self._events["hedges"] += 1
+            return True
+
+    def _end_hedge(self, future):
+        with self._lock:
+            self._hedges_in_flight -= 1
+
+    def call(self, task, model_name, fn, pinned=False, should_failover=None):
+        """Run fn(model_name, attempt) on the routed candidates and return the first success.
+
+        `attempt` is the RouteAttempt; its `cancel` event is set when another
+        attempt wins or the call gives up, and only requests made through
+        attempt.send() are timed and hedged. Errors for which
+        `should_failover(error)` is false (e.g. an invalid request) are
+        raised at once instead of being retried on another model.
+        """
+        order = self.route(task, model_name, pinned)
+        slo = self.slo(task)
+        pending = {}
+        last_error = None
+        next_index = 0
+        hedging = True
+        newest = None
+
+        def launch(hedge=False):
+            nonlocal next_index, newest
+            attempt = newest = RouteAttempt(order[next_index])
+            next_index += 1
+            future = self._executor.submit(self._timed, fn, attempt)
+            if hedge:
+                # Also runs when the future is cancelled before it started
+                future.add_done_callback(self._end_hedge)
+            pending[future] = attempt
+
+        launch()
+        try:
+            while pending:
+                timeout = deadline = None
+                if hedging and next_index < len(order):
+                    # The hedge clock runs only while the request is actually out,
+                    # never while it waits for quota or backs off after a 429
+                    sent_at = newest.sent_at
+                    if sent_at is None:
+                        timeout = _SEND_POLL_SECONDS
+                    else:
+                        deadline = sent_at + self._hedge_after(newest.model_name, slo)
+                        timeout = max(0.0, deadline - time.perf_counter())
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    if deadline is None or newest.sent_at != sent_at:
+                        continue
+                    # Too slow: hedge on the next candidate and keep both racing
+                    if self._start_hedge():
+                        launch(hedge=True)
+                    else:
+                        hedging = False
+                    continue
+                for future in done:
+                    attempt = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if should_failover is not None and not should_failover(e):
+                            raise
+                        last_error = e
+                        continue
+                    if attempt.model_name != order[0]:
+                        with self._lock:
+                            self._events["fallback_wins"] += 1
+                    return result
+                if not pending and next_index < len(order):
+                    with self._lock:
+                        self._events["failovers"] += 1
+                    launch()
+            raise last_error
+        finally:
+            # Losing attempts still waiting for quota (or a worker) are never sent
+            for future, attempt in pending.items():
+                attempt.cancel.set()
+                future.cancel()
+
+    def metrics(self):
+        """Per-model latency/error figures plus routing decisions"""
+        with self._lock:
+            models = [
+                {
+                    "model": name,
+                    "requests": stats.requests,
+                    "p50_s": stats.percentile(0.50),
+                    "p95_s": stats.percentile(0.95),
+                    "error_rate": stats.error_rate,
+                }
+                for name, stats in sorted(self._stats.items())
+            ]
+            decisions = {f"{task} → {model}": count for (task, model), count in self._decisions.items()}
+            return {"models": models, "decisions": decisions, "events": dict(self._events)}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_model_router():
+    """Return the process-wide model router"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
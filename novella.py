@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from gemini_utility import gemini_pro_response, gemini_stream_response
+from instrumentation import metrics
+from prompt_templates import render
+from response_cache import CACHE_DIR
+
+NOVELLA_DIR = os.path.join(CACHE_DIR, "novellas")
+# Chapters of one novella written at the same time
+NOVELLA_PARALLEL = int(os.getenv("FABLEFORGE_NOVELLA_PARALLEL", "3"))
+MIN_CHAPTERS = 2
+MAX_CHAPTERS = 20
+
+PENDING = "pending"
+WRITING = "writing"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_OUTLINE_LINE = re.compile(r"^\W*chapter\s+(\d+)\s*[:.)-]\s*(.+?)\s*\|\s*(.+)$", re.IGNORECASE)
+
+
+@dataclass
+class Chapter:
+    """One chapter of a novella; `text` grows while it streams"""
+    number: int
+    title: str
+    synopsis: str
+    status: str = PENDING
+    text: str = ""
+    summary: str = None
+    error: str = None
+    latency: float = None
+    path: str = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+
+def parse_outline(text):
+    """Return [(title, synopsis)] from "Chapter N: Title | Synopsis" lines, in chapter order"""
+    chapters = {}
+    for line in text.splitlines():
+        match = _OUTLINE_LINE.match(line.strip().replace("**", ""))
+        if match:
+            number, title, synopsis = match.groups()
+            chapters.setdefault(int(number), (title.strip(" \"'"), synopsis.strip()))
+    return [chapters[number] for number in sorted(chapters)]
+
+
+class Novella:
+    """A chaptered story written from a cached outline.
+
+    plan() generates the outline through the response cache, so the same
+    idea and settings reuse it. start() then streams the chapters on a small
+    per-novella pool. Each chapter sees the outline plus a running summary:
+    the short summaries of chapters already written, and the outline's
+    synopses for the rest. A finished chapter is written to disk straight
+    away, and any one chapter can be regenerated without touching the others.
+    """
+
+    def __init__(self, idea, chapters=5, tone="Cheerful", audience="All Ages", words=600,
+                 overrides=None, use_cache=True, directory=None, parallel=NOVELLA_PARALLEL):
+        self.id = uuid.uuid4().hex[:12]
+        self.inputs = {
+            "idea": idea,
+            "chapters": max(MIN_CHAPTERS, min(int(chapters), MAX_CHAPTERS)),
+            "tone": tone,
+            "audience": audience,
+        }
+        self.words = int(words)
+        self.overrides = dict(overrides or {})
+        # The chapter length setting, not the sidebar token cap, sizes each chapter
+        self.chapter_overrides = {**self.overrides, "max_tokens": self.words * 2}
+        self.use_cache = use_cache
+        self.directory = directory or os.path.join(NOVELLA_DIR, self.id)
+        self.chapters = []
+        self.outline_result = None
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="novella")
+
+    @property
+    def outline(self):
+        return "\n".join(
+            f"Chapter {chapter.number}: {chapter.title} | {chapter.synopsis}" for chapter in self.chapters
+        )
+
+    def plan(self):
+        """Generate (or reuse the cached) outline; returns the GenerationResult"""
+        rendered = render("novella_outline", self.inputs)
+        result = self._outline(rendered, self.use_cache)
+        outline = parse_outline(result.text) if result.ok else []
+        if result.ok and not outline and result.cached:
+            # An unreadable outline in the cache is replaced, not served again
+            result = self._outline(rendered, False)
+            outline = parse_outline(result.text) if result.ok else []
+        self.outline_result = result
+        if not result.ok:
+            return result
+        if not outline:
+            result.error = "The outline could not be read. Please try again."
+            return result
+        self.chapters = [
+            Chapter(number, title, synopsis)
+            for number, (title, synopsis) in enumerate(outline[:self.inputs["chapters"]], 1)
+        ]
+        os.makedirs(self.directory, exist_ok=True)
+        self._write("outline.md", self.outline)
+        self.save()
+        return result
+
+    def _outline(self, rendered, use_cache):
+        return gemini_pro_response(
+            rendered.prompt, use_cache=use_cache, task=rendered.task, overrides=self.overrides
+        )
+
+    def start(self):
+        """Queue every chapter; the pool writes them in order, a few at a time"""
+        for chapter in self.chapters:
+            self._executor.submit(self._write_chapter, chapter)
+        return self
+
+    def regenerate(self, number):
+        """Write chapter `number` again with the current running summary"""
+        chapter = self.chapters[number - 1]
+        if not chapter.finished:
+            return False
+        chapter.status, chapter.text, chapter.error = PENDING, "", None
+        self._executor.submit(self._write_chapter, chapter)
+        return True
+
+    def story_so_far(self, number):
+        """Running summary of the chapters before `number`"""
+        return "\n".join(
+            f"Chapter {chapter.number} ({chapter.title}): {chapter.summary or chapter.synopsis}"
+            for chapter in self.chapters[:number - 1]
+        )
+
+    def _write_chapter(self, chapter):
+        if self._cancelled.is_set():
+            chapter.status = CANCELLED
+            return
+        start = time.perf_counter()
+        rendered = render("novella_chapter", {
+            **{key: self.inputs[key] for key in ("idea", "tone", "audience")},
+            "outline": self.outline,
+            "story_so_far": self.story_so_far(chapter.number),
+            "number": chapter.number,
+            "title": chapter.title,
+            "synopsis": chapter.synopsis,
+            "words": self.words,
+        })
+        stream = gemini_stream_response(rendered.prompt, task=rendered.task, overrides=self.chapter_overrides)
+        if stream.ok:
+            chapter.status = WRITING
+            chunks = iter(stream)
+            try:
+                for text in chunks:
+                    if self._cancelled.is_set():
+                        break
+                    chapter.text += text
+            finally:
+                chunks.close()
+        chapter.latency = time.perf_counter() - start
+        if self._cancelled.is_set():
+            chapter.status = CANCELLED
+        elif not stream.ok or not chapter.text.strip():
+            chapter.status, chapter.error = FAILED, stream.error or "The model returned no text"
+        else:
+            chapter.path = self._write(
+                f"chapter_{chapter.number:02d}.md", f"## {chapter.title}\n\n{chapter.text}"
+            )
+            chapter.summary = self._summarize(chapter)
+            chapter.status = DONE
+        metrics.observe("novella_chapter", chapter.latency, status=chapter.status)
+        self.save()
+
+    def _summarize(self, chapter):
+        """Short summary that stands in for the chapter in later prompts"""
+        rendered = render("chapter_summary", {"text": chapter.text})
+        result = gemini_pro_response(rendered.prompt, task=rendered.task)
+        # Without a summary the outline's synopsis keeps standing in for the chapter
+        return result.text.strip() if result.ok else None
+
+    def _write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            # Write then rename, so readers never see a half-written file
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+        return path
+
+    def save(self):
+        """Write novella.json and the chapters finished so far as novella.md"""
+        self._write("novella.md", self.manuscript())
+        self._write("novella.json", json.dumps(
+            {
+                "id": self.id,
+                **self.inputs,
+                "words": self.words,
+                "chapters": [asdict(chapter) for chapter in self.chapters]
+            },
+            ensure_ascii=False,
+            indent=2
+        ))
+
+    def manuscript(self):
+        """The finished chapters as one Markdown document"""
+        return "\n\n".join(
+            f"## Chapter {chapter.number}: {chapter.title}\n\n{chapter.text}"
+            for chapter in self.chapters if chapter.status == DONE
+        )
+
+    def cancel(self):
+        """Stop writing; chapters in progress end where they are"""
+        self._cancelled.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for chapter in self.chapters:
+            if chapter.status == PENDING:
+                chapter.status = CANCELLED
+
+    @property
+    def finished(self):
+        return all(chapter.finished for chapter in self.chapters)
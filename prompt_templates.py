@@ -0,0 +1,113 @@
+from dataclasses import dataclass
+from generation_profiles import task_key
+
+IMAGE_STORY_LENGTHS = {
+    "Short (5-10 lines)": "5-10 lines",
+    "Medium (10-20 lines)": "10-20 lines",
+    "Long (20-30 lines)": "20-30 lines",
+}
+
+
+@dataclass
+class RenderedPrompt:
+    """A page prompt plus the generation arguments that go with it"""
+    prompt: str
+    task: str
+    semantic_scope: tuple = None
+    semantic_text: str = None
+    needs_image: bool = False
+
+
+def image_story(theme, length, genre, include_moral):
+    prompt = f"""Generate a {genre.lower()} story based on this image with the following requirements:
+- Theme/Details: {theme}
+- Length: {IMAGE_STORY_LENGTHS.get(length, length)}
+- Genre: {genre}
+- Include moral lesson: {include_moral}
+
+Make the story engaging, creative, and well-structured."""
+    return RenderedPrompt(prompt, "image_story", needs_image=True)
+
+def text_story(idea, length, tone, audience):
+    prompt = f"""Create a {length.lower()} {tone.lower()} story suitable for {audience.lower()}
+based on: {idea}
+
+Make it engaging and include a meaningful conclusion."""
+    return RenderedPrompt(
+        prompt,
+        "text_story",
+        semantic_scope=("text_story", length, tone, audience),
+        semantic_text=idea,
+    )
+
+def novella_outline(idea, chapters, tone, audience):
+    prompt = f"""Plan a {tone.lower()} novella in {chapters} chapters suitable for {audience.lower()}
+based on: {idea}
+
+Write exactly one line per chapter in this format and nothing else:
+Chapter <number>: <title> | <two-sentence synopsis>"""
+    return RenderedPrompt(prompt, "novella_outline")
+
+def novella_chapter(idea, tone, audience, outline, story_so_far, number, title, synopsis, words):
+    prompt = f"""You are writing a {tone.lower()} novella suitable for {audience.lower()} based on: {idea}
+
+Outline:
+{outline}
+
+Story so far:
+{story_so_far or "Nothing yet. This is the first chapter."}
+
+Write chapter {number}, "{title}": {synopsis}
+Write about {words} words of prose. Do not repeat the chapter title or retell earlier chapters, and end where the synopsis ends."""
+    return RenderedPrompt(prompt, "novella_chapter")
+
+def chapter_summary(text):
+    prompt = (
+        "Summarize this chapter in two or three sentences. Keep the names, events and open threads "
+        "the next chapters depend on:\n\n" + text
+    )
+    return RenderedPrompt(prompt, "chapter_summary")
+
+def poem(style, theme, mood, length):
+    prompt = f"Write a {style.lower()} poem about {theme} with a {mood.lower()} mood. Length: {length.lower()}"
+    return RenderedPrompt(
+        prompt,
+        "haiku" if style == "Haiku" else "poem",
+        semantic_scope=("poem", style, mood, length),
+        semantic_text=theme,
+    )
+
+def comic_preview(script):
+    return RenderedPrompt(f"Enhance this story for comic video: {script}", "comic_preview")
+
+def assistant(task, text, tone=None, language=None):
+    if task == "Change Tone":
+        prompt = f"Rewrite this text in a {tone.lower()} tone: {text}"
+    elif task == "Translate":
+        prompt = f"Translate this text to {language}: {text}"
+    else:
+        prompt = f"{task} this text: {text}"
+    return RenderedPrompt(prompt, task_key(task))
+
+def chat(message):
+    return RenderedPrompt(message, "chat")
+
+
+TEMPLATES = {
+    "image_story": image_story,
+    "text_story": text_story,
+    "novella_outline": novella_outline,
+    "novella_chapter": novella_chapter,
+    "chapter_summary": chapter_summary,
+    "poem": poem,
+    "comic_preview": comic_preview,
+    "assistant": assistant,
+    "chat": chat,
+}
+
+def render(template, inputs):
+    """Build the prompt for a named template from its recorded inputs"""
+    builder = TEMPLATES.get(template)
+    if builder is None:
+        raise ValueError(f"Unknown prompt template: {template}")
+    return builder(**inputs)
@@ -0,0 +1,185 @@
+import os
+import time
+import heapq
+import random
+import itertools
+import threading
+
+RATE_LIMIT_RPM = float(os.getenv("FABLEFORGE_RATE_LIMIT_RPM", "60"))
+RATE_LIMIT_TPM = float(os.getenv("FABLEFORGE_RATE_LIMIT_TPM", "1000000"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("FABLEFORGE_RATE_LIMIT_MAX_RETRIES", "4"))
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BULK = 10
+
+TASK_PRIORITIES = {
+    "chat": PRIORITY_INTERACTIVE,
+    "chat_summary": PRIORITY_INTERACTIVE,
+}
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request could not get capacity within its deadline"""
+
+
+class RequestCancelled(Exception):
+    """Raised when a request was cancelled while it waited for capacity"""
+
+
+class InMemoryBucketBackend:
+    """Token-bucket state held in this process.
+
+    A backend only has to implement try_acquire(); a file-lock or SQLite
+    backend with the same method can share one budget across processes.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, requests):
+        """Atomically take from several buckets.
+
+        `requests` is a list of (bucket name, amount, capacity, refill per
+        second). Returns 0.0 when every bucket had enough, otherwise the
+        seconds to wait; nothing is taken unless everything fits.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = {}
+            wait = 0.0
+            for name, amount, capacity, refill_per_second in requests:
+                tokens, updated_at = self._buckets.get(name, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+                levels[name] = tokens
+                # Requests larger than the bucket are let through once it is full
+                amount = min(amount, capacity)
+                if tokens < amount:
+                    wait = max(wait, (amount - tokens) / refill_per_second)
+            for name, amount, capacity, _ in requests:
+                tokens = levels[name]
+                if not wait:
+                    tokens -= min(amount, capacity)
+                self._buckets[name] = (tokens, now)
+            return wait
+
+
+class QuotaScheduler:
+    """Shared requests-per-minute and tokens-per-minute limiter with priority queues.
+
+    Callers wait in a priority heap; only the head of the queue may take
+    capacity, so interactive requests overtake queued bulk work.
+    """
+
+    def __init__(self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM, backend=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.backend = backend or InMemoryBucketBackend()
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self.stats = {"granted": 0, "waited_seconds": 0.0, "retries": 0, "cancelled": 0, "max_queue_depth": 0}
+
+    @property
+    def queue_depth(self):
+        with self._condition:
+            return len(self._queue)
+
+    def _try_take(self, tokens):
+        return self.backend.try_acquire([
+            ("requests", 1, self.rpm, self.rpm / 60.0),
+            ("tokens", tokens, self.tpm, self.tpm / 60.0),
+        ])
+
+    def acquire(self, tokens=1, priority=PRIORITY_DEFAULT, timeout=None):
+        """Block until this request may be sent"""
+        start = time.monotonic()
+        entry = (priority, next(self._counter))
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self._queue))
+            try:
+                while True:
+                    wait = None
+                    if self._queue[0] == entry:
+                        wait = self._try_take(tokens)
+                        if not wait:
+                            heapq.heappop(self._queue)
+                            self.stats["granted"] += 1
+                            self.stats["waited_seconds"] += time.monotonic() - start
+                            return
+                    if timeout is not None:
+                        remaining = timeout - (time.monotonic() - start)
+                        if remaining <= 0:
+                            raise RateLimitTimeout("Timed out waiting for API quota")
+                        wait = min(wait or remaining, remaining)
+                    self._condition.wait(wait)
+            finally:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                self._condition.notify_all()
+
+    def run(self, fn, tokens=1, priority=PRIORITY_DEFAULT, is_retryable=None,
+            max_retries=RATE_LIMIT_MAX_RETRIES, base_delay=1.0, max_delay=30.0, cancel=None):
+        """Acquire capacity and call fn(), retrying retryable errors with jittered backoff
+
+        `cancel` is an optional threading.Event; once it is set, the request
+        is not sent and RequestCancelled is raised instead.
+        """
+        is_retryable = is_retryable or is_rate_limit_error
+        for attempt in range(max_retries + 1):
+            self.acquire(tokens, priority)
+            # The wait for quota can be long; don't send what nobody wants any more
+            if cancel is not None and cancel.is_set():
+                self.stats["cancelled"] += 1
+                raise RequestCancelled("Request cancelled while waiting for quota")
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == max_retries or not is_retryable(e):
+                    raise
+                self.stats["retries"] += 1
+                # Full jitter keeps many sessions from retrying in lockstep
+                time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def is_rate_limit_error(error):
+    """True for 429 (quota) and 503 (overloaded) errors from the Gemini API"""
+    code = getattr(error, "code", None)
+    if callable(code):
+        code = code()
+    code = getattr(code, "value", code)
+    if isinstance(code, tuple):
+        code = code[0]
+    if code in (429, 503):
+        return True
+    name = type(error).__name__
+    return name in ("ResourceExhausted", "ServiceUnavailable", "TooManyRequests")
+
+def estimate_request_tokens(contents, max_output_tokens=0):
+    """Rough token estimate (~4 characters per token) for the TPM budget"""
+    if isinstance(contents, str):
+        characters = len(contents)
+    else:
+        characters = sum(len(part) for part in contents if isinstance(part, str))
+        # Inline images are billed at a flat rate of roughly 258 tokens
+        characters += 258 * 4 * sum(1 for part in contents if not isinstance(part, str))
+    return characters // 4 + max_output_tokens
+
+def task_priority(task):
+    return TASK_PRIORITIES.get(task, PRIORITY_DEFAULT)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_quota_scheduler():
+    """Return the process-wide quota scheduler shared by all sessions"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = QuotaScheduler()
+        return _scheduler
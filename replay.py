@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+FableForge AI Story Engine - Request Log Replay
+Replays a recorded request log (see FABLEFORGE_REQUEST_LOG) against the
+generation layer at its original pacing, or faster, and reports cache hit
+rates, queue depths and tail latency.
+
+Usage:
+    python replay.py .fableforge/requests.jsonl --speed 10
+    python replay.py .fableforge/requests.jsonl --speed 0 --real
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import functools
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Replays start from a cold cache, and fake responses must never reach the app's cache
+os.environ.setdefault("FABLEFORGE_CACHE_DIR", tempfile.mkdtemp(prefix="fableforge-replay-"))
+
+from PIL import Image
+
+from chat_utility import send_chat_message, stream_chat_message
+from fake_backends import FakeBackend, add_backend_arguments, backend_config_from_args
+from gemini_utility import (
+    gemini_pro_response,
+    gemini_pro_vision_response,
+    gemini_stream_response,
+    get_semantic_cache,
+    load_model_for_task
+)
+from image_utility import prepare_upload
+from model_router import get_model_router
+from prompt_templates import render
+from rate_limiter import get_quota_scheduler
+from request_log import read_request_log
+from response_cache import get_response_cache
+from stats_utility import format_stat, percentile
+from story_variants import DONE, VariantRun
+
+DEFAULT_LOG = os.path.join(".fableforge", "requests.jsonl")
+
+
+@functools.lru_cache(maxsize=16)
+def _placeholder_image(width, height):
+    """Uploads are not logged; replay a plain image of the recorded size"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (128, 128, 128)).save(buffer, format="PNG")
+    return prepare_upload(buffer.getvalue()).blob
+
+
+class Replayer:
+    """Send recorded requests to the generation layer and collect per-request outcomes"""
+
+    def __init__(self, workers=32):
+        self.workers = workers
+        self.outcomes = []
+        self.in_flight = 0
+        self.depth_samples = []
+        self._chat_sessions = {}
+        self._session_locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def _chat_turn(self, record, message):
+        session = record.get("session") or "default"
+        with self._session_locks[session]:
+            chat_session = self._chat_sessions.get(session)
+            if chat_session is None:
+                model, _ = load_model_for_task("chat", record.get("overrides"))
+                chat_session = self._chat_sessions[session] = model.start_chat(history=[])
+            start = time.perf_counter()
+            if record.get("stream"):
+                first_token = None
+                for _ in stream_chat_message(chat_session, message):
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                return True, False, first_token
+            send_chat_message(chat_session, message)
+            return True, False, None
+
+    def _variants(self, record, rendered, image):
+        # Which version the user kept is not logged, so every variant runs to the end
+        run = VariantRun(rendered.prompt, rendered.task, record.get("overrides"), record["variants"], image)
+        run.start().wait()
+        first_tokens = [variant.first_token for variant in run.variants if variant.first_token is not None]
+        ok = all(variant.status == DONE for variant in run.variants)
+        return ok, False, min(first_tokens) if first_tokens else None
+
+    def _generate(self, record):
+        """Run one record and return (ok, cached, time to first token)"""
+        rendered = render(record["template"], record["inputs"])
+        overrides = record.get("overrides")
+        use_cache = record.get("use_cache", True)
+        if record["template"] == "chat":
+            return self._chat_turn(record, rendered.prompt)
+        image = None
+        if rendered.needs_image:
+            width, height = record.get("image_size") or (1024, 768)
+            image = _placeholder_image(width, height)
+        if record.get("variants", 1) > 1:
+            return self._variants(record, rendered, image)
+        if image is not None:
+            result = gemini_pro_vision_response(rendered.prompt, image, use_cache, rendered.task, overrides)
+            return result.ok, result.cached, None
+        if record.get("stream"):
+            start = time.perf_counter()
+            first_token = None
+            stream = gemini_stream_response(rendered.prompt, task=rendered.task, overrides=overrides)
+            for _ in stream:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+            return stream.ok, False, first_token
+        result = gemini_pro_response(
+            rendered.prompt,
+            use_cache=use_cache,
+            semantic_scope=rendered.semantic_scope,
+            semantic_text=rendered.semantic_text,
+            task=rendered.task,
+            overrides=overrides
+        )
+        return result.ok, result.cached, None
+
+    def _run(self, record, due):
+        started = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            ok, cached, first_token = self._generate(record)
+        except Exception as e:
+            print(f"Error replaying {record['template']} request: {e}")
+            ok, cached, first_token = False, False, None
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        finished = time.perf_counter()
+        with self._lock:
+            self.outcomes.append({
+                "page": record.get("page"),
+                "template": record["template"],
+                "ok": ok,
+                "cached": cached,
+                "latency": finished - started,
+                # Includes time spent waiting for a free replay worker
+                "response": finished - due,
+                "first_token": first_token,
+            })
+
+    def _sample_depths(self, stop, interval):
+        scheduler = get_quota_scheduler()
+        while not stop.wait(interval):
+            with self._lock:
+                in_flight = self.in_flight
+            self.depth_samples.append((scheduler.queue_depth, in_flight))
+
+    def replay(self, records, speed=1.0, sample_interval=0.05):
+        """Dispatch records at their recorded offsets divided by `speed` (0 = back to back)"""
+        if not records:
+            return 0.0
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_depths, args=(stop, sample_interval), daemon=True)
+        sampler.start()
+        first_timestamp = records[0]["timestamp"]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="replay") as executor:
+            for record in records:
+                offset = (record["timestamp"] - first_timestamp) / speed if speed > 0 else 0.0
+                due = start + offset
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._run, record, due)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+        return elapsed
+
+
+def summarize_outcomes(outcomes):
+    latencies = sorted(outcome["latency"] for outcome in outcomes if outcome["ok"])
+    responses = sorted(outcome["response"] for outcome in outcomes if outcome["ok"])
+    first_tokens = sorted(outcome["first_token"] for outcome in outcomes if outcome["first_token"] is not None)
+    return {
+        "requests": len(outcomes),
+        "errors": sum(not outcome["ok"] for outcome in outcomes),
+        "cache_hit_rate": sum(outcome["cached"] for outcome in outcomes) / len(outcomes) if outcomes else 0.0,
+        "p50_s": percentile(latencies, 0.50),
+        "p95_s": percentile(latencies, 0.95),
+        "p99_s": percentile(latencies, 0.99),
+        "max_s": latencies[-1] if latencies else None,
+        "response_p99_s": percentile(responses, 0.99),
+        "ttft_p95_s": percentile(first_tokens, 0.95),
+    }
+
+def build_report(replayer, elapsed, args):
+    by_template = defaultdict(list)
+    for outcome in replayer.outcomes:
+        by_template[outcome["template"]].append(outcome)
+    scheduler_depths = sorted(depth for depth, _ in replayer.depth_samples)
+    in_flight = sorted(count for _, count in replayer.depth_samples)
+    return {
+        "timestamp": time.time(),
+        "log": args.log,
+        "speed": args.speed,
+        "backend": "real" if args.real else "fake",
+        "elapsed_s": elapsed,
+        "overall": summarize_outcomes(replayer.outcomes),
+        "templates": {template: summarize_outcomes(outcomes) for template, outcomes in sorted(by_template.items())},
+        "queues": {
+            "quota_queue_p95": percentile(scheduler_depths, 0.95),
+            "quota_queue_max": get_quota_scheduler().stats["max_queue_depth"],
+            "in_flight_p95": percentile(in_flight, 0.95),
+            "in_flight_max": in_flight[-1] if in_flight else 0,
+        },
+        "caches": {
+            "response": dict(get_response_cache().stats),
+            "semantic": get_semantic_cache().stats(),
+        },
+        "router": get_model_router().metrics(),
+    }
+
+
+def print_report(report):
+    print(f"\n{'template':<14} {'req':>5} {'err':>4} {'hit%':>6} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'max':>7} {'resp99':>7} {'ttft95':>7}")
+    rows = list(report["templates"].items()) + [("ALL", report["overall"])]
+    for name, row in rows:
+        print(
+            f"{name:<14} {row['requests']:>5} {row['errors']:>4} {row['cache_hit_rate'] * 100:>6.1f} "
+            f"{format_stat(row['p50_s'], '7.3f')} {format_stat(row['p95_s'], '7.3f')} {format_stat(row['p99_s'], '7.3f')} "
+            f"{format_stat(row['max_s'], '7.3f')} {format_stat(row['response_p99_s'], '7.3f')} "
+            f"{format_stat(row['ttft_p95_s'], '7.3f')}"
+        )
+    queues = report["queues"]
+    print(
+        f"\n📥 Quota queue depth p95 {queues['quota_queue_p95'] or 0}, max {queues['quota_queue_max']} | "
+        f"In flight p95 {queues['in_flight_p95'] or 0}, max {queues['in_flight_max']}"
+    )
+    semantic = report["caches"]["semantic"]
+    print(f"🧠 Semantic cache hit rate {semantic['hit_rate']:.0%} over {semantic['lookups']} lookups")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a FableForge request log")
+    parser.add_argument("log", nargs="?", default=DEFAULT_LOG, help="JSONL request log to replay")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed multiplier (2 = twice as fast, 0 = no pauses)")
+    parser.add_argument("--workers", type=int, default=32, help="Maximum requests in flight")
+    parser.add_argument("--limit", type=int, help="Replay only the first N requests")
+    parser.add_argument("--real", action="store_true", help="Call the real APIs instead of the fake backend")
+    parser.add_argument("--output", help="Save the JSON report to this file")
+    add_backend_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.log):
+        print(f"❌ Request log not found: {args.log}")
+        print("💡 Set FABLEFORGE_REQUEST_LOG before running the app to record one.")
+        return 1
+    records = read_request_log(args.log)[:args.limit]
+    if not records:
+        print(f"❌ No requests in {args.log}")
+        return 1
+
+    span = records[-1]["timestamp"] - records[0]["timestamp"]
+    print(f"▶️ Replaying {len(records)} requests spanning {span:.0f}s at {args.speed:g}x "
+          f"against the {'real' if args.real else 'fake'} backend")
+    replayer = Replayer(args.workers)
+    if args.real:
+        elapsed = replayer.replay(records, args.speed)
+    else:
+        with FakeBackend(backend_config_from_args(args)).installed():
+            elapsed = replayer.replay(records, args.speed)
+
+    report = build_report(replayer, elapsed, args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
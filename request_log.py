@@ -0,0 +1,51 @@
+import os
+import json
+import time
+import threading
+
+REQUEST_LOG = os.getenv("FABLEFORGE_REQUEST_LOG")
+
+_lock = threading.Lock()
+
+
+def log_request(page, template, inputs, session=None, path=REQUEST_LOG, **details):
+    """Append one generation request to the JSONL request log, if one is configured.
+
+    Records hold the page, the prompt template name and its inputs (not the
+    rendered prompt), so replay.py can rebuild the same calls later.
+    `details` carries anything else the replay needs, such as the sidebar
+    overrides or whether the request was streamed.
+    """
+    if not path:
+        return
+    record = {
+        "timestamp": time.time(),
+        "session": session,
+        "page": page,
+        "template": template,
+        "inputs": inputs,
+        **details,
+    }
+    try:
+        with _lock, open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Warning: could not write request log {path}. Error: {e}")
+
+def read_request_log(path):
+    """Return the records of a JSONL request log sorted by timestamp, skipping malformed lines"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Warning: skipping malformed line {line_number} of {path}")
+                continue
+            if "template" in record and "timestamp" in record:
+                records.append(record)
+    records.sort(key=lambda record: record["timestamp"])
+    return records
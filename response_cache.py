@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+working_dir = os.path.dirname(os.path.abspath(__file__))
+
+CACHE_DIR = os.getenv("FABLEFORGE_CACHE_DIR", os.path.join(working_dir, ".fableforge"))
+CACHE_MEMORY_ITEMS = int(os.getenv("FABLEFORGE_CACHE_MEMORY_ITEMS", "256"))
+CACHE_MAX_MB = float(os.getenv("FABLEFORGE_CACHE_MAX_MB", "64"))
+CACHE_TTL = float(os.getenv("FABLEFORGE_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def image_digest(image):
+    """Stable content hash for a PIL image, an inline {mime_type, data} blob or raw bytes"""
+    if image is None:
+        return None
+    digest = hashlib.sha256()
+    if isinstance(image, (bytes, bytearray)):
+        digest.update(image)
+    elif isinstance(image, dict):
+        digest.update(image.get("mime_type", "").encode())
+        digest.update(image["data"])
+    else:
+        digest.update(f"{image.mode}:{image.size}".encode())
+        digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Content-addressed response cache with an in-memory LRU and a SQLite tier.
+
+    Entries expire after `ttl` seconds. The disk tier is trimmed to
+    `max_bytes` by dropping the least recently used rows.
+    """
+
+    def __init__(self, path, memory_items=CACHE_MEMORY_ITEMS,
+                 max_bytes=int(CACHE_MAX_MB * 1024 * 1024), ttl=CACHE_TTL):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(model, prompt, image_digest=None, generation_config=None):
+        """Hash (model, prompt, image digest, generation config) into a cache key"""
+        payload = json.dumps(
+            {
+                "model": model,
+                "prompt": prompt,
+                "image": image_digest,
+                "config": generation_config or {},
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached value or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, row[0], row[1])
+            self.stats["disk_hits"] += 1
+            return row[0]
+
+    def set(self, key, value):
+        """Store a value in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now)
+            )
+            self.stats["writes"] += 1
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._memory.pop(key, None)
+            total -= size
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Return the process-wide response cache, opening the database on first use"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(os.path.join(CACHE_DIR, "responses.sqlite3"))
+        return _response_cache
@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+import numpy as np
+
+SEMANTIC_THRESHOLD = float(os.getenv("FABLEFORGE_SEMANTIC_THRESHOLD", "0.92"))
+SEMANTIC_MAX_ENTRIES = int(os.getenv("FABLEFORGE_SEMANTIC_MAX_ENTRIES", "512"))
+
+
+class _ScopeIndex:
+    """Normalized prompt vectors and their responses for one scope"""
+
+    def __init__(self, dimension):
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.responses = []
+        self.latencies = []
+
+
+class SemanticCache:
+    """Near-duplicate prompt cache backed by cosine similarity over embeddings.
+
+    Entries live in separate NumPy indexes per scope (page + selected
+    options), so a prompt only matches prompts generated under the same
+    settings. `embed` is any callable returning a vector (or None on
+    failure) for a text; failures simply disable the lookup for that call.
+    """
+
+    def __init__(self, embed, threshold=SEMANTIC_THRESHOLD, max_entries=SEMANTIC_MAX_ENTRIES):
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.time_saved = 0.0
+        self.embed_time = 0.0
+
+    def _vector(self, text):
+        start = time.perf_counter()
+        try:
+            vector = self.embed(text)
+        except Exception as e:
+            print(f"Semantic cache embedding failed: {e}")
+            return None
+        finally:
+            self.embed_time += time.perf_counter() - start
+        if vector is None or len(vector) == 0:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, text, scope):
+        """Return (cached response or None, query vector) for a prompt in a scope"""
+        start = time.perf_counter()
+        vector = self._vector(text)
+        with self._lock:
+            self.lookups += 1
+            index = self._indexes.get(scope)
+            if vector is None or index is None or not index.responses:
+                return None, vector
+            if index.vectors.shape[1] != vector.shape[0]:
+                return None, vector
+            similarities = index.vectors @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None, vector
+            self.hits += 1
+            self.time_saved += max(index.latencies[best] - (time.perf_counter() - start), 0.0)
+            return index.responses[best], vector
+
+    def store(self, text, scope, response, latency, vector=None):
+        """Add a generated response; pass the vector from lookup() to skip re-embedding"""
+        if vector is None:
+            vector = self._vector(text)
+            if vector is None:
+                return
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None or index.vectors.shape[1] != vector.shape[0]:
+                index = self._indexes[scope] = _ScopeIndex(vector.shape[0])
+            index.vectors = np.vstack([index.vectors, vector[np.newaxis, :]])
+            index.responses.append(response)
+            index.latencies.append(latency)
+            if len(index.responses) > self.max_entries:
+                overflow = len(index.responses) - self.max_entries
+                index.vectors = index.vectors[overflow:]
+                del index.responses[:overflow]
+                del index.latencies[:overflow]
+
+    def stats(self):
+        """Return hit rate and time saved for tuning the threshold"""
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "time_saved": self.time_saved,
+                "embed_time": self.embed_time,
+                "entries": sum(len(index.responses) for index in self._indexes.values()),
+                "threshold": self.threshold,
+            }
+
+    def clear(self):
+        """Drop every scope index"""
+        with self._lock:
+            self._indexes.clear()
@@ -0,0 +1,10 @@
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+def format_stat(value, spec):
+    """Format a report cell with `spec`, or a right-aligned "-" when there is no value"""
+    width = int(spec.split(".")[0])
+    return "-".rjust(width) if value is None else format(value, spec)
@@ -0,0 +1,155 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from gemini_utility import gemini_stream_response
+from generation_profiles import resolve_profile
+from instrumentation import metrics
+
+MAX_VARIANTS = 4
+# Temperature gap between neighbouring variants
+VARIANT_SPREAD = float(os.getenv("FABLEFORGE_VARIANT_SPREAD", "0.15"))
+VARIANT_WORKERS = int(os.getenv("FABLEFORGE_VARIANT_WORKERS", "16"))
+
+PENDING = "pending"
+STREAMING = "streaming"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+@dataclass
+class StoryVariant:
+    """One of several generations of the same prompt; `text` grows while it streams"""
+    index: int
+    temperature: float
+    status: str = PENDING
+    text: str = ""
+    model: str = None
+    error: str = None
+    latency: float = None
+    first_token: float = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+
+def variant_temperatures(base, count, spread=VARIANT_SPREAD):
+    """`count` temperatures centred on `base`, `spread` apart, within Gemini's 0-2 range"""
+    return [
+        round(min(2.0, max(0.0, base + (index - (count - 1) / 2) * spread)), 2)
+        for index in range(count)
+    ]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=VARIANT_WORKERS, thread_name_prefix="story-variant")
+        return _executor
+
+
+class VariantRun:
+    """Stream several variants of one prompt at once, each at its own temperature.
+
+    start() returns at once; worker threads stream the variants into their
+    `text` so the UI can show them side by side while they arrive. pick()
+    keeps one variant and cancels the rest, including ones still waiting
+    for quota.
+    """
+
+    def __init__(self, prompt, task, overrides=None, count=3, image=None):
+        self.prompt = prompt
+        self.task = task
+        self.overrides = dict(overrides or {})
+        self.image = image
+        base = resolve_profile(task, self.overrides)[1]["temperature"]
+        count = max(1, min(int(count), MAX_VARIANTS))
+        self.variants = [
+            StoryVariant(index, temperature)
+            for index, temperature in enumerate(variant_temperatures(base, count))
+        ]
+        self.picked = None
+        self._cancel = [threading.Event() for _ in self.variants]
+        self._futures = []
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._futures = [_get_executor().submit(self._stream, variant) for variant in self.variants]
+        return self
+
+    def wait(self, timeout=None):
+        """Block until every variant has finished, or `timeout` seconds; returns `finished`"""
+        wait(self._futures, timeout)
+        return self.finished
+
+    def _stream(self, variant):
+        cancel = self._cancel[variant.index]
+        if cancel.is_set():
+            variant.status = CANCELLED
+            return
+        start = time.perf_counter()
+        overrides = {**self.overrides, "temperature": variant.temperature}
+        stream = gemini_stream_response(
+            self.prompt, task=self.task, overrides=overrides, image=self.image, cancel=cancel
+        )
+        variant.model = stream.result.model
+        if cancel.is_set() and not stream.ok:
+            # Picked against while it waited for quota; the request was never sent
+            variant.status = CANCELLED
+            metrics.increment("story_variant_cancelled", task=self.task)
+            return
+        if not stream.ok:
+            variant.status, variant.error = FAILED, stream.error
+            return
+        variant.status = STREAMING
+        chunks = iter(stream)
+        stopped = False
+        try:
+            for text in chunks:
+                if cancel.is_set():
+                    stopped = True
+                    break
+                if variant.first_token is None:
+                    variant.first_token = time.perf_counter() - start
+                variant.text += text
+        finally:
+            # Closing the generator releases the response, which ends the stream
+            chunks.close()
+        variant.latency = time.perf_counter() - start
+        if stopped:
+            variant.status = CANCELLED
+            metrics.increment("story_variant_cancelled", task=self.task)
+        elif stream.ok:
+            variant.status = DONE
+        else:
+            variant.status, variant.error = FAILED, stream.error
+
+    def pick(self, index):
+        """Keep variant `index` and cancel the others"""
+        self.picked = index
+        for variant, cancel in zip(self.variants, self._cancel):
+            if variant.index != index and not variant.finished:
+                cancel.set()
+        metrics.observe("story_variant_pick", time.perf_counter() - self._started_at, task=self.task)
+        return self.variants[index]
+
+    def cancel(self):
+        """Stop every variant that is still running"""
+        for cancel in self._cancel:
+            cancel.set()
+
+    @property
+    def chosen(self):
+        return None if self.picked is None else self.variants[self.picked]
+
+    @property
+    def finished(self):
+        return all(variant.finished for variant in self.variants)
@@ -0,0 +1,245 @@
+import io
+import os
+import re
+import time
+import wave
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from instrumentation import metrics, record_io, timed
+
+TTS_API_URL = "https://api-inference.huggingface.co/models/facebook/mms-tts-eng"
+TTS_TIMEOUT = float(os.getenv("FABLEFORGE_TTS_TIMEOUT", "30"))
+TTS_MAX_RETRIES = int(os.getenv("FABLEFORGE_TTS_MAX_RETRIES", "4"))
+TTS_WORKERS = int(os.getenv("FABLEFORGE_TTS_WORKERS", "4"))
+TTS_MAX_CHARS = int(os.getenv("FABLEFORGE_TTS_MAX_CHARS", "400"))
+# Never sleep longer than this for a model that reports it is still loading
+TTS_MAX_LOADING_WAIT = 30.0
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+class TTSError(Exception):
+    """Raised when a segment cannot be synthesized after all retries"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def split_sentences(text, max_chars=TTS_MAX_CHARS):
+    """Split text at sentence boundaries into chunks of at most max_chars"""
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = " ".join(sentence.split())
+        if not sentence:
+            continue
+        # Very long sentences are cut at word boundaries
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+def join_wav(segments, lead_silence=0.0):
+    """Concatenate WAV byte strings that share the same format, after `lead_silence` seconds of silence"""
+    output = io.BytesIO()
+    writer = None
+    try:
+        for segment in segments:
+            with wave.open(io.BytesIO(segment), "rb") as reader:
+                if writer is None:
+                    writer = wave.open(output, "wb")
+                    writer.setparams(reader.getparams())
+                    frames = int(lead_silence * reader.getframerate())
+                    writer.writeframes(b"\0" * frames * reader.getsampwidth() * reader.getnchannels())
+                writer.writeframes(reader.readframes(reader.getnframes()))
+    finally:
+        if writer is not None:
+            writer.close()
+    return output.getvalue()
+
+def wav_duration(audio):
+    """Playing time of a WAV byte string, in seconds"""
+    with wave.open(io.BytesIO(audio), "rb") as reader:
+        return reader.getnframes() / reader.getframerate()
+
+
+class TTSClient:
+    """Hugging Face TTS client with a pooled session, retries and parallel synthesis"""
+
+    def __init__(self, api_key, api_url=TTS_API_URL, timeout=TTS_TIMEOUT,
+                 max_retries=TTS_MAX_RETRIES, workers=TTS_WORKERS, max_chars=TTS_MAX_CHARS,
+                 backoff=1.0):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_chars = max_chars
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Accept": "audio/wav",
+            "Connection": "keep-alive",
+        })
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+
+    def _delay(self, attempt, response=None):
+        delay = self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+        if response is not None and response.status_code == 503:
+            # The inference API answers 503 with an estimate while the model loads
+            try:
+                estimated = float(response.json().get("estimated_time", 0))
+            except ValueError:
+                estimated = 0.0
+            delay = max(delay, min(estimated, TTS_MAX_LOADING_WAIT))
+        return delay
+
+    def synthesize_segment(self, text):
+        """Synthesize one chunk of text, retrying transient failures"""
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                with timed("tts_request"):
+                    response = self.session.post(self.api_url, json={"inputs": text}, timeout=self.timeout)
+                record_io("tts_request", len(text.encode("utf-8")), len(response.content))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise TTSError(f"Audio request failed: {e}") from e
+            else:
+                if response.status_code == 200:
+                    return response.content
+                metrics.increment("tts_request_status", status=response.status_code)
+                if response.status_code not in (429, 500, 502, 503, 504) or attempt == self.max_retries:
+                    raise TTSError(
+                        f"Audio generation failed. Status: {response.status_code}",
+                        response.status_code
+                    )
+            time.sleep(self._delay(attempt, response))
+
+    def submit_segment(self, text):
+        """Schedule one chunk on the client's thread pool and return its future"""
+        return self._executor.submit(self.synthesize_segment, text)
+
+    @timed("tts_synthesize")
+    def synthesize(self, text):
+        """Split text into sentences, synthesize them in parallel and join the WAV audio"""
+        chunks = split_sentences(text, self.max_chars)
+        if not chunks:
+            return None
+        if len(chunks) == 1:
+            return self.synthesize_segment(chunks[0])
+        segments = list(self._executor.map(self.synthesize_segment, chunks))
+        try:
+            return join_wav(segments)
+        except (wave.Error, EOFError) as e:
+            # Non-WAV audio cannot be spliced; fall back to a single request
+            print(f"Warning: could not join audio segments, synthesizing in one request. Error: {e}")
+            return self.synthesize_segment(" ".join(chunks))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+class NarrationPipeline:
+    """Turn streamed story text into TTS jobs sentence by sentence.
+
+    Feed text chunks as they arrive; every complete sentence is queued for
+    synthesis right away (batched up to `min_chars` after the first one so
+    narration can start early). Finished segments are handed back strictly in
+    story order.
+    """
+
+    def __init__(self, client, min_chars=120):
+        self.client = client
+        self.min_chars = min(min_chars, client.max_chars)
+        self.started_at = time.perf_counter()
+        self.first_audio_at = None
+        self._buffer = ""
+        self._pending = ""
+        self._futures = []
+        self._next = 0
+
+    def _submit(self, text):
+        self._futures.append(self.client.submit_segment(text))
+
+    def _queue_sentence(self, sentence):
+        self._pending = f"{self._pending} {sentence}".strip()
+        if not self._futures or len(self._pending) >= self.min_chars:
+            for chunk in split_sentences(self._pending, self.client.max_chars):
+                self._submit(chunk)
+            self._pending = ""
+
+    def feed(self, text):
+        """Add streamed text and queue every sentence it completes"""
+        self._buffer += text
+        sentences = _SENTENCE_END.split(self._buffer)
+        self._buffer = sentences.pop()
+        for sentence in sentences:
+            if sentence.strip():
+                self._queue_sentence(" ".join(sentence.split()))
+
+    def finish(self):
+        """Queue whatever text is left once the stream has ended"""
+        rest = f"{self._pending} {self._buffer}".strip()
+        self._buffer = self._pending = ""
+        for chunk in split_sentences(rest, self.client.max_chars):
+            self._submit(chunk)
+
+    def _collect(self, block):
+        while self._next < len(self._futures):
+            future = self._futures[self._next]
+            if not block and not future.done():
+                return
+            self._next += 1
+            try:
+                audio, error = future.result(), None
+            except Exception as e:
+                audio, error = None, e
+            if audio is not None and self.first_audio_at is None:
+                self.first_audio_at = time.perf_counter()
+            yield audio, error
+
+    def ready_segments(self):
+        """Yield (audio, error) for segments finished so far, without blocking"""
+        return self._collect(block=False)
+
+    def remaining_segments(self):
+        """Yield (audio, error) for every outstanding segment, waiting as needed"""
+        return self._collect(block=True)
+
+    @property
+    def time_to_first_audio(self):
+        if self.first_audio_at is None:
+            return None
+        return self.first_audio_at - self.started_at
+
+
+_tts_clients = {}
+_tts_clients_lock = threading.Lock()
+
+def get_tts_client(api_key):
+    """Return a shared TTSClient for this API key"""
+    with _tts_clients_lock:
+        client = _tts_clients.get(api_key)
+        if client is None:
+            client = _tts_clients[api_key] = TTSClient(api_key)
+        return client
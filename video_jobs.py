@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from instrumentation import metrics
+from response_cache import CACHE_DIR
+
+VIDEO_SPACE = os.getenv("FABLEFORGE_VIDEO_SPACE", "ADOPLE/Video-Generator-AI")
+VIDEO_API_NAME = "/generate_video"
+VIDEO_JOBS_DIR = os.path.join(CACHE_DIR, "video_jobs")
+VIDEO_TIMEOUT = float(os.getenv("FABLEFORGE_VIDEO_TIMEOUT", "900"))
+VIDEO_WORKERS = int(os.getenv("FABLEFORGE_VIDEO_WORKERS", "4"))
+VIDEO_JOBS_KEEP = int(os.getenv("FABLEFORGE_VIDEO_JOBS_KEEP", "20"))
+# Finished jobs of any owner are deleted after this many days
+VIDEO_JOBS_MAX_AGE = float(os.getenv("FABLEFORGE_VIDEO_JOBS_MAX_AGE_DAYS", "7")) * 24 * 3600
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class VideoJob:
+    """State of one comic video generation, persisted as JSON"""
+    id: str
+    prompt: str
+    owner: str = None
+    status: str = QUEUED
+    progress: str = "Waiting to start"
+    created_at: float = 0.0
+    updated_at: float = 0.0
+    video_path: str = None
+    error: str = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+
+def _video_bytes(result):
+    """Pull the video out of a Space response (bytes, a file path, or a dict/tuple holding one)"""
+    if isinstance(result, dict):
+        return _video_bytes(result.get("video"))
+    if isinstance(result, (list, tuple)):
+        return _video_bytes(result[0]) if result else None
+    if isinstance(result, (bytes, bytearray)):
+        return bytes(result)
+    if isinstance(result, str) and os.path.isfile(result):
+        with open(result, "rb") as f:
+            return f.read()
+    return None
+
+def _describe_status(update):
+    """Human-readable progress from a gradio_client StatusUpdate"""
+    code = getattr(getattr(update, "code", None), "value", None)
+    if code == "IN_QUEUE" and update.rank is not None:
+        text = f"In queue: position {update.rank + 1}"
+        if update.queue_size:
+            text += f" of {update.queue_size}"
+        return text + (f" (~{update.eta:.0f}s)" if update.eta else "")
+    if code == "PROGRESS" and update.progress_data:
+        unit = update.progress_data[-1]
+        if unit.index is not None and unit.length:
+            return f"Rendering {unit.index / unit.length:.0%}"
+        if unit.progress is not None:
+            return f"Rendering {unit.progress:.0%}"
+    if code in ("PROCESSING", "ITERATING", "PROGRESS"):
+        return "Generating video..."
+    if code in ("STARTING", "JOINING_QUEUE", "SENDING_DATA"):
+        return "Connecting to the video service..."
+    return None
+
+
+class VideoJobStore:
+    """Job records (<id>.json) and finished videos (<id>.mp4) in one directory.
+
+    The records are read from disk once and then served from an in-memory
+    index, so polling the job list does not re-read every file.
+    """
+
+    def __init__(self, directory=VIDEO_JOBS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._jobs = {}
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                job = self.load(name[:-5])
+                if job is not None:
+                    self._jobs[job.id] = job
+        # Videos whose record is gone can never be listed again
+        for name in os.listdir(directory):
+            if name.endswith(".mp4") and name[:-4] not in self._jobs:
+                self._remove(os.path.join(directory, name))
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def artifact_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.mp4")
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def save(self, job):
+        job.updated_at = time.time()
+        path = self._path(job.id)
+        with self._lock:
+            self._jobs[job.id] = job
+            # Write then rename, so readers never see a half-written record
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(asdict(job), f)
+            os.replace(path + ".tmp", path)
+
+    def load(self, job_id):
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                record = json.load(f)
+            # Records written before jobs had an owner keyed them by session
+            record.setdefault("owner", record.pop("session_id", None))
+            return VideoJob(**record)
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def all(self, owner=None):
+        """Every job (only `owner`'s when given), newest first"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if owner is None or job.owner == owner]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def prune(self, owner=None, keep=VIDEO_JOBS_KEEP, max_age=VIDEO_JOBS_MAX_AGE):
+        """Delete finished jobs and their videos.
+
+        `owner`'s oldest jobs beyond `keep` go, and so do anyone's (including
+        records without an owner) older than `max_age` seconds.
+        """
+        finished = [job for job in self.all() if job.finished]
+        expired = {job.id for job in finished if time.time() - job.updated_at > max_age}
+        if owner is not None:
+            expired.update(job.id for job in [job for job in finished if job.owner == owner][keep:])
+        for job_id in expired:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            self._remove(self._path(job_id))
+            self._remove(self.artifact_path(job_id))
+
+
+class VideoJobQueue:
+    """Run comic video generations in the background on one shared Gradio client.
+
+    submit() returns at once; a worker thread connects (once per process),
+    calls client.submit(), waits for the result and writes the video to the
+    job store. Jobs belong to the owner that submitted them (a stable id kept
+    in the page URL); they survive reruns, page changes and browser reloads,
+    and finished videos survive app restarts.
+    """
+
+    def __init__(self, store=None, space=VIDEO_SPACE, api_name=VIDEO_API_NAME,
+                 timeout=VIDEO_TIMEOUT, workers=VIDEO_WORKERS):
+        self.store = store or VideoJobStore()
+        self.space = space
+        self.api_name = api_name
+        self.timeout = timeout
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._running = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="video-job")
+        # Jobs left unfinished by a previous process cannot be resumed
+        for job in self.store.all():
+            if not job.finished:
+                job.status = FAILED
+                job.error = "Interrupted by an app restart. Please submit it again."
+                self.store.save(job)
+        self.store.prune()
+
+    def client(self):
+        """Return the shared Gradio client, connecting on first use"""
+        with self._client_lock:
+            if self._client is None:
+                # Deferred: gradio_client is slow to import and only this page needs it
+                from gradio_client import Client
+                start = time.perf_counter()
+                self._client = Client(self.space)
+                metrics.observe("video_client_connect", time.perf_counter() - start)
+            return self._client
+
+    def submit(self, prompt, owner):
+        """Queue a video generation for `owner` and return its VideoJob without waiting"""
+        now = time.time()
+        job = VideoJob(id=uuid.uuid4().hex[:12], prompt=prompt, owner=owner, created_at=now)
+        self.store.save(job)
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        start = time.perf_counter()
+        try:
+            gradio_job = self.client().submit(job.prompt, api_name=self.api_name)
+            with self._lock:
+                self._running[job.id] = gradio_job
+            job.status, job.progress = RUNNING, "Submitted"
+            self.store.save(job)
+            video = _video_bytes(gradio_job.result(timeout=self.timeout))
+            if not video:
+                raise ValueError("The video service returned no video")
+            with open(self.store.artifact_path(job.id), "wb") as f:
+                f.write(video)
+            job.status, job.progress, job.video_path = DONE, "Finished", self.store.artifact_path(job.id)
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                e = TimeoutError(f"no result after {self.timeout:.0f}s")
+            else:
+                # A broken connection is re-established for the next job
+                with self._client_lock:
+                    self._client = None
+            job.status, job.error = FAILED, str(e)
+            metrics.increment("video_job_failures")
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+        metrics.observe("video_job", time.perf_counter() - start, status=job.status)
+        self.store.save(job)
+        self.store.prune(job.owner)
+
+    def jobs(self, owner, limit=10):
+        """`owner`'s recent jobs, newest first, with live progress for running ones"""
+        jobs = self.store.all(owner)[:limit]
+        with self._lock:
+            running = dict(self._running)
+        for job in jobs:
+            gradio_job = running.get(job.id)
+            if gradio_job is not None and not job.finished:
+                try:
+                    job.progress = _describe_status(gradio_job.status()) or job.progress
+                except Exception:
+                    pass
+        return jobs
+
+    def active(self, owner):
+        """True while any of `owner`'s jobs is queued or running"""
+        return any(not job.finished for job in self.store.all(owner))
+
+
+_video_queue = None
+_video_queue_lock = threading.Lock()
+
+def get_video_job_queue():
+    """Return the process-wide video job queue"""
+    global _video_queue
+    with _video_queue_lock:
+        if _video_queue is None:
+            _video_queue = VideoJobQueue()
+        return _video_queue